@@ -0,0 +1,77 @@
+import hashlib
+import hmac
+import secrets
+from types import MappingProxyType
+
+# ==========================================
+# 密碼雜湊 (PBKDF2-SHA256 + 隨機鹽)
+#   試算表中存成 "pbkdf2_sha256$迭代次數$鹽$雜湊"，尚未轉換的舊明文密碼仍可登入，
+#   由管理員執行一次 migrate_account_passwords 後全面改為雜湊。
+# ==========================================
+HASH_PREFIX = "pbkdf2_sha256"
+HASH_ITERATIONS = 100_000
+
+
+def is_hashed(stored):
+    return str(stored).startswith(HASH_PREFIX + "$")
+
+
+def hash_password(password, salt=None, iterations=HASH_ITERATIONS):
+    salt = salt or secrets.token_hex(16)
+    digest = hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), salt.encode("utf-8"), iterations).hex()
+    return f"{HASH_PREFIX}${iterations}${salt}${digest}"
+
+
+def verify_password(password, stored):
+    try:
+        _, iterations, salt, digest = stored.split("$")
+        iterations = int(iterations)
+    except ValueError:
+        return False
+    candidate = hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), salt.encode("utf-8"), iterations).hex()
+    return hmac.compare_digest(candidate, digest)
+
+
+# ==========================================
+# 帳號庫 (帳號表載入時建立一次)
+# ==========================================
+class AccountStore:
+    """帳號 → 登入資料 的字典索引，登入時 O(1) 查找並驗證雜湊。
+
+    舊明文密碼不會以明文留在記憶體：建立時改存成只在本行程有效的加鹽 SHA-256。
+    """
+
+    def __init__(self, df_accounts):
+        self._pepper = secrets.token_bytes(16)
+        entries = {}
+        if not df_accounts.empty and "帳號" in df_accounts.columns:
+            for r in df_accounts.to_dict("records"):
+                username, stored = str(r.get("帳號", "")).strip(), str(r.get("密碼", "")).strip()
+                if not username or not stored: continue
+                secret = stored if is_hashed(stored) else self._legacy_digest(stored)
+                profile = MappingProxyType({"role": r.get("職務", ""), "name": r.get("姓名", ""), "class": r.get("負責班級", "全校")})
+                entries.setdefault(username, []).append((secret, profile))
+        self._entries = MappingProxyType({k: tuple(v) for k, v in entries.items()})
+
+    def _legacy_digest(self, password):
+        return hashlib.sha256(self._pepper + password.encode("utf-8")).hexdigest()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, username):
+        return username in self._entries
+
+    def authenticate(self, username, password):
+        """驗證成功回傳 {"role", "name", "class"}，失敗回傳 None。"""
+        for secret, profile in self._entries.get(str(username).strip(), ()):
+            if is_hashed(secret):
+                ok = verify_password(password, secret)
+            else:
+                ok = hmac.compare_digest(self._legacy_digest(password), secret)
+            if ok: return dict(profile)
+        return None
+
+    @property
+    def plaintext_count(self):
+        return sum(1 for entries in self._entries.values() for secret, _ in entries if not is_hashed(secret))
@@ -1,566 +1,610 @@
 import streamlit as st
 import streamlit.components.v1 as components
 import pandas as pd
-import json
-import gspread
-from google.oauth2.service_account import Credentials
+import io
+import re
+import time
 from datetime import datetime, timedelta
 
-# ==========================================
-# 頁面配置 & 台灣時間
-# ==========================================
-st.set_page_config(page_title="樹人家商-校園管理整合系統", layout="wide")
-tw_time = datetime.utcnow() + timedelta(hours=8)
-today_date = tw_time.strftime("%Y-%m-%d")
+import reports
+from data_store import (
+    LOG_HEADERS, STATIC_SHEETS, append_log_rows, archive_closed_months, as_text, closed_month_rows, get_metrics, get_write_queue,
+    leave_conflicts, leave_form_batches, leaves_on, load_accounts, load_patrol_partition, load_score_aggregates, load_static_data,
+    log_memory_report, migrate_account_passwords, query_log, record_rerun, refresh_sheets, reward_form_batches, save_log_edits,
+    student_timeline, write_status,
+)
 
-# ==========================================
-# 系統共用常數 (班級清單與僑生專班)
-# ==========================================
-REAL_CLASS_LIST = {
-    "一年級": ["商一忠", "資處一忠", "觀一忠", "觀一孝", "觀一仁", "餐一忠", "餐一孝", "餐一仁", "餐一愛", "餐一信", "餐一義", "餐一和", "餐一平", "幼一忠", "美一忠", "美一孝", "美一仁", "影一忠", "資訊一忠", "資訊一孝", "資訊一仁"],
-    "二年級": ["商二忠", "資處二忠", "資處二孝", "觀二忠", "觀二孝", "餐二忠", "餐二孝", "餐二仁", "餐二愛", "餐二信", "餐二義", "餐二和", "幼二忠", "美二忠", "美二孝", "美二仁", "影二忠", "影二孝", "資訊二忠", "資訊二孝", "資訊二仁"],
-    "三年級": ["商三忠", "電三忠", "資處三忠", "資處三孝", "觀三忠", "觀三孝", "觀三仁", "餐三忠", "餐三孝", "餐三仁", "餐三愛", "餐三信", "餐三義", "餐三和", "幼三忠", "幼三孝", "美三忠", "美三孝", "美三仁", "影三忠", "資訊三忠"]
-}
+rerun_started = time.perf_counter()
 
-# 🌟 僑生班級專屬名單 (用於權限過濾)
-OVERSEAS_CLASSES = ["餐一和", "餐一平", "資訊一孝", "資訊一仁", "觀一孝", "觀一仁", "資訊二孝", "資訊二仁"]
+# st.rerun() / st.stop() 以例外結束本次執行，計時放在 finally 才不會漏算
+try:
+    # ==========================================
+    # 頁面配置 & 台灣時間
+    # ==========================================
+    st.set_page_config(page_title="樹人家商-校園管理整合系統", layout="wide")
+    tw_time = datetime.utcnow() + timedelta(hours=8)
+    today_date = tw_time.strftime("%Y-%m-%d")
 
-# ==========================================
-# 安全讀取引擎
-# ==========================================
-def safe_get_dataframe(sheet):
-    if sheet is None: return pd.DataFrame()
-    data = sheet.get_all_values()
-    if not data: return pd.DataFrame()
-    headers = data[0]
-    clean_headers = []
-    for i, h in enumerate(headers):
-        val = str(h).strip()
-        if not val: val = f"未命名欄位_{i}"
-        while val in clean_headers: val += "_重複"
-        clean_headers.append(val)
-    if len(data) > 1: return pd.DataFrame(data[1:], columns=clean_headers)
-    return pd.DataFrame(columns=clean_headers)
+    # ==========================================
+    # 系統共用常數 (班級清單與僑生專班)
+    # ==========================================
+    REAL_CLASS_LIST = {
+        "一年級": ["商一忠", "資處一忠", "觀一忠", "觀一孝", "觀一仁", "餐一忠", "餐一孝", "餐一仁", "餐一愛", "餐一信", "餐一義", "餐一和", "餐一平", "幼一忠", "美一忠", "美一孝", "美一仁", "影一忠", "資訊一忠", "資訊一孝", "資訊一仁"],
+        "二年級": ["商二忠", "資處二忠", "資處二孝", "觀二忠", "觀二孝", "餐二忠", "餐二孝", "餐二仁", "餐二愛", "餐二信", "餐二義", "餐二和", "幼二忠", "美二忠", "美二孝", "美二仁", "影二忠", "影二孝", "資訊二忠", "資訊二孝", "資訊二仁"],
+        "三年級": ["商三忠", "電三忠", "資處三忠", "資處三孝", "觀三忠", "觀三孝", "觀三仁", "餐三忠", "餐三孝", "餐三仁", "餐三愛", "餐三信", "餐三義", "餐三和", "幼三忠", "幼三孝", "美三忠", "美三孝", "美三仁", "影三忠", "資訊三忠"]
+    }
 
-# ==========================================
-# Google 試算表連線與智慧快取引擎
-# ==========================================
-@st.cache_resource
-def init_gspread():
-    creds_json = json.loads(st.secrets["google_json"])
-    scopes = ["https://www.googleapis.com/auth/spreadsheets", "https://www.googleapis.com/auth/drive"]
-    creds = Credentials.from_service_account_info(creds_json, scopes=scopes)
-    return gspread.authorize(creds)
+    # 🌟 僑生班級專屬名單 (用於權限過濾)
+    OVERSEAS_CLASSES = ["餐一和", "餐一平", "資訊一孝", "資訊一仁", "觀一孝", "觀一仁", "資訊二孝", "資訊二仁"]
 
-# 1. 靜態資料快取
-@st.cache_data(ttl=600)
-def load_static_data():
-    client = init_gspread()
-    doc = client.open("全校巡查總資料庫")
-    
-    # 讀取學生名單
-    try:
+    # ==========================================
+    # 共用元件：學號 CSV 讀取
+    #   條碼槍匯出的通常沒有標題列；Excel (繁體中文) 存的 CSV 是 cp950 編碼
+    # ==========================================
+    def read_id_csv(raw):
+        """取「學號」欄 (第一列為標題時)，沒有則取第一欄；無法解析時丟出 ValueError。"""
+        for encoding in ("utf-8-sig", "cp950"):
+            try:
+                text = raw.decode(encoding)
+                break
+            except UnicodeDecodeError: continue
+        else: raise ValueError("無法辨識檔案編碼 (請存成 UTF-8 或 Big5 的 CSV)")
         try:
-            ws_stu = doc.worksheet("學生名單")
-        except:
-            ws_stu = doc.worksheet("基本資料庫") 
-            
-        df_stu = safe_get_dataframe(ws_stu)
-        df_stu.columns = df_stu.columns.str.strip()
-        rename_map = {"班級名稱": "班級", "手機號碼": "學生手機", "家長電話": "家長聯絡電話"}
-        df_stu.rename(columns=rename_map, inplace=True)
-        
-        for col in ['學號', '姓名', '班級', '座號', '學生手機', '家長聯絡電話']:
-            if col not in df_stu.columns: df_stu[col] = ""
-        df_stu['學號'] = df_stu['學號'].astype(str).str.strip()
-        df_stu['座號'] = df_stu['座號'].astype(str).str.zfill(2)
-    except: 
-        df_stu = pd.DataFrame(columns=['學號', '姓名', '班級', '座號', '學生手機', '家長聯絡電話'])
-    
-    # 讀取帳號密碼
-    try:
-        df_acc = safe_get_dataframe(doc.worksheet("系統帳號密碼"))
-        if '帳號' in df_acc.columns:
-            df_acc['帳號'] = df_acc['帳號'].astype(str).str.strip()
-            df_acc['密碼'] = df_acc['密碼'].astype(str).str.strip()
-    except:
-        ws_acc = doc.add_worksheet(title="系統帳號密碼", rows="100", cols="5")
-        ws_acc.append_row(["帳號", "密碼", "職務", "姓名", "負責班級"])
-        ws_acc.append_row(["admin", "1234", "管理員", "展宏主任", "全校"])
-        df_acc = pd.DataFrame([{"帳號":"admin", "密碼":"1234", "職務":"管理員", "姓名":"展宏主任", "負責班級":"全校"}])
-        
-    # 讀取獎懲條文
-    try:
-        df_rules = safe_get_dataframe(doc.worksheet("獎懲條文"))
-    except: df_rules = pd.DataFrame()
-    
-    return df_stu, df_acc, df_rules
+            df = pd.read_csv(io.StringIO(text), header=None, dtype=str).fillna("")
+        except (pd.errors.EmptyDataError, pd.errors.ParserError) as e:
+            raise ValueError("檔案是空的或不是有效的 CSV") from e
+        header = [str(v).strip() for v in df.iloc[0]]
+        if "學號" in header: return df[header.index("學號")].iloc[1:].str.strip().tolist()
+        return df[0].str.strip().tolist()
 
-# 2. 動態紀錄資料快取 
-@st.cache_data(ttl=60)
-def load_log_data(sheet_name):
-    client = init_gspread()
-    doc = client.open("全校巡查總資料庫")
-    try:
-        ws = doc.sheet1 if sheet_name == "巡查紀錄" else doc.worksheet(sheet_name)
-        return safe_get_dataframe(ws)
-    except: return pd.DataFrame()
+    # ==========================================
+    # 共用元件：學生個人歷程 (由學號搜尋開啟)
+    # ==========================================
+    def student_profile(student_id, key):
+        if not st.toggle("📇 查看此學生的巡查/請假/獎懲歷程", key=f"{key}_profile"): return
+        timeline = student_timeline(student_id)
+        if timeline.empty:
+            st.info("此學生尚無任何紀錄。")
+            return
+        counts = timeline["來源"].value_counts()
+        m1, m2, m3, m4 = st.columns(4)
+        m1.metric("巡查紀錄", int(counts.get("巡查", 0)))
+        m2.metric("巡查累計得分", f"{timeline['累計得分'].iloc[-1]:g}")
+        m3.metric("請假紀錄", int(counts.get("請假", 0)))
+        m4.metric("獎懲紀錄", int(counts.get("獎懲", 0)))
+        st.dataframe(timeline.iloc[::-1], use_container_width=True, hide_index=True)  # 最新的在最上面
 
-# 3. 專屬寫入通道
-def get_sheet_for_writing(sheet_name, default_headers=None):
-    client = init_gspread()
-    doc = client.open("全校巡查總資料庫")
-    if sheet_name == "巡查紀錄": return doc.sheet1
-    try:
-        return doc.worksheet(sheet_name)
-    except:
-        ws = doc.add_worksheet(title=sheet_name, rows="2000", cols=max(15, len(default_headers) if default_headers else 15))
-        if default_headers: ws.append_row(default_headers)
-        return ws
+    # ==========================================
+    # 載入資料與記憶體初始化
+    # ==========================================
+    roster, df_rules, rules_dict = load_static_data()
+    get_write_queue()  # 程式一啟動就建立背景寫入佇列，上次未送出的 spool 批次立即補送
 
-# ==========================================
-# 載入資料與記憶體初始化
-# ==========================================
-df_students, df_accounts, df_rules = load_static_data()
-student_db = df_students.set_index('學號').to_dict('index') if not df_students.empty else {}
+    for key in ["temp_records", "leave_cart", "reward_cart", "write_batches"]:
+        if key not in st.session_state: st.session_state[key] = [] 
+    if "current_user" not in st.session_state: st.session_state.current_user = None
 
-for key in ["temp_records", "leave_cart", "reward_cart"]:
-    if key not in st.session_state: st.session_state[key] = [] 
-if "current_user" not in st.session_state: st.session_state.current_user = None
+    # 背景寫入進度 (每 3 秒自動更新，不阻塞畫面)
+    @st.fragment(run_every=3)
+    def show_write_status():
+        st.caption("📨 最近送出的資料")
+        for batch_id, label in st.session_state.write_batches[-5:]:
+            info = write_status(batch_id)
+            state = {"queued": "⏳ 排隊寫入中", "committed": "✅ 已寫入", "failed": "❌ 寫入失敗"}.get(info["state"], "❔ 狀態不明")
+            st.caption(f"{state}｜{label}" + (f"\n\n{info['error']}" if info.get("error") else ""))
 
-# ==========================================
-# 側邊欄：登入與嚴密權限控管
-# ==========================================
-with st.sidebar:
-    st.title("📂 系統選單")
-    if st.session_state.current_user is None:
-        st.subheader("🔐 人員登入")
-        login_user = st.text_input("請輸入帳號")
-        login_pwd = st.text_input("請輸入密碼", type="password")
-        if st.button("登入系統", type="primary", use_container_width=True):
-            if df_accounts.empty:
-                st.error("⚠️ 系統尚未讀取到帳號庫。")
-            else:
-                match = df_accounts[(df_accounts['帳號'] == login_user) & (df_accounts['密碼'] == login_pwd)]
-                if not match.empty:
-                    user_info = match.iloc[0]
-                    st.session_state.current_user = {"role": user_info.get('職務', ''), "name": user_info.get('姓名', ''), "class": user_info.get('負責班級', '全校')}
-                    st.rerun()
+    # ==========================================
+    # 側邊欄：登入與嚴密權限控管
+    # ==========================================
+    with st.sidebar:
+        st.title("📂 系統選單")
+        if st.session_state.current_user is None:
+            st.subheader("🔐 人員登入")
+            login_user = st.text_input("請輸入帳號")
+            login_pwd = st.text_input("請輸入密碼", type="password")
+            if st.button("登入系統", type="primary", use_container_width=True):
+                accounts = load_accounts()  # 帳號表只在按下登入時才讀取
+                if len(accounts) == 0:
+                    st.error("⚠️ 系統尚未讀取到帳號庫。")
                 else:
-                    st.error("❌ 帳號或密碼錯誤！")
-    else:
-        u = st.session_state.current_user
-        st.success(f"✅ 登入成功\n\n👤 {u['name']}\n🏷️ {u['role']}\n📍 {u['class']}")
+                    user_info = accounts.authenticate(login_user, login_pwd)
+                    if user_info:
+                        st.session_state.current_user = user_info
+                        st.rerun()
+                    else:
+                        st.error("❌ 帳號或密碼錯誤！")
+        else:
+            u = st.session_state.current_user
+            st.success(f"✅ 登入成功\n\n👤 {u['name']}\n🏷️ {u['role']}\n📍 {u['class']}")
         
-        if u["role"] == "管理員":
-            if st.button("🔄 強制重整雲端資料庫", use_container_width=True):
-                st.cache_data.clear() 
-                st.success("✅ 資料庫已重新同步！")
-                st.rerun()
+            if u["role"] == "管理員":
+                with st.expander("🔄 強制重整雲端資料庫"):
+                    all_sheets = STATIC_SHEETS + list(LOG_HEADERS)
+                    resync_sheets = st.multiselect("選擇要重新同步的工作表", all_sheets, default=all_sheets)
+                    if st.button("立即重新同步", use_container_width=True, disabled=not resync_sheets):
+                        refresh_sheets(resync_sheets)
+                        st.success("✅ 資料庫已重新同步！")
+                        st.rerun()
+                accounts = load_accounts()
+                if accounts.plaintext_count:
+                    with st.expander(f"🔐 尚有 {accounts.plaintext_count} 組明文密碼"):
+                        st.caption("將帳號表中的明文密碼一次轉換為加鹽雜湊，轉換後原密碼仍可照常登入。")
+                        if st.button("立即加密所有密碼", use_container_width=True):
+                            n_hashed = migrate_account_passwords()
+                            st.success(f"✅ 已加密 {n_hashed} 組密碼！")
+                            st.rerun()
                 
-        if st.button("🚪 登出系統", use_container_width=True):
-            st.session_state.current_user = None
-            st.rerun()
+            if st.button("🚪 登出系統", use_container_width=True):
+                st.session_state.current_user = None
+                st.rerun()
 
-    st.divider()
-    menu_options = []
-    if st.session_state.current_user:
-        curr_role = st.session_state.current_user["role"]
-        curr_class = st.session_state.current_user["class"]
+            if st.session_state.write_batches: show_write_status()
+
+        st.divider()
+        menu_options = []
+        if st.session_state.current_user:
+            curr_role = st.session_state.current_user["role"]
+            curr_class = st.session_state.current_user["class"]
         
-        # 1. 巡查登記：排除導師
-        if curr_role in ["學務主任", "教務主任", "生輔員", "行政", "管理員"]: 
-            menu_options.append("🔭 全校巡查登記")
+            # 1. 巡查登記：排除導師
+            if curr_role in ["學務主任", "教務主任", "生輔員", "行政", "管理員"]: 
+                menu_options.append("🔭 全校巡查登記")
             
-        # 2. 僑生假單：🌟 嚴密限制 (僅限管理員，或被綁定為僑生班級的導師)
-        if curr_role == "管理員" or (curr_role == "導師" and curr_class in OVERSEAS_CLASSES): 
-            menu_options.append("📝 僑生假單申請")
+            # 2. 僑生假單：🌟 嚴密限制 (僅限管理員，或被綁定為僑生班級的導師)
+            if curr_role == "管理員" or (curr_role == "導師" and curr_class in OVERSEAS_CLASSES): 
+                menu_options.append("📝 僑生假單申請")
             
-        # 3. 獎懲建議單：包含所有導師與行政人員
-        if curr_role in ["導師", "行政", "生輔員", "學務主任", "教務主任", "管理員"]:
-            menu_options.append("🏆 獎懲建議單申請")
+            # 3. 獎懲建議單：包含所有導師與行政人員
+            if curr_role in ["導師", "行政", "生輔員", "學務主任", "教務主任", "管理員"]:
+                menu_options.append("🏆 獎懲建議單申請")
             
-        # 4. 數據中心：僅限管理員
-        if curr_role == "管理員": 
-            menu_options.append("📊 綜合數據中心 (管理員專屬)")
+            # 4. 數據中心：僅限管理員
+            if curr_role == "管理員": 
+                menu_options.append("📊 綜合數據中心 (管理員專屬)")
             
-    app_mode = st.radio("功能切換", menu_options if menu_options else ["🔒 系統已鎖定"])
+        app_mode = st.radio("功能切換", menu_options if menu_options else ["🔒 系統已鎖定"])
 
-# ==========================================
-# 模組一：全校巡查登記
-# ==========================================
-if app_mode == "🔭 全校巡查登記":
-    st.header("🔭 全校巡查即時登記")
-    time_period = st.selectbox("請選擇巡查時間", ["0810-0900 第一節", "0910-1000 第二節", "1010-1100 第三節", "1110-1200 第四節", "1230-1300 午休", "1310-1400 第五節", "1410-1500 第六節", "1510-1600 第七節"])
-    record_type = st.radio("📌 請選擇登記對象", ["班級整體表現", "個人違規紀錄"], horizontal=True)
+    # ==========================================
+    # 模組一：全校巡查登記
+    # ==========================================
+    if app_mode == "🔭 全校巡查登記":
+        st.header("🔭 全校巡查即時登記")
+        time_period = st.selectbox("請選擇巡查時間", ["0810-0900 第一節", "0910-1000 第二節", "1010-1100 第三節", "1110-1200 第四節", "1230-1300 午休", "1310-1400 第五節", "1410-1500 第六節", "1510-1600 第七節"])
+        record_type = st.radio("📌 請選擇登記對象", ["班級整體表現", "個人違規紀錄", "多位學生批次登記"], horizontal=True)
     
-    if record_type == "班級整體表現":
-        col1, col2 = st.columns(2)
-        with col1: grade = st.selectbox("👉 先選年級", ["一年級", "二年級", "三年級"])
-        with col2: selected_class = st.selectbox("👉 再選班級", REAL_CLASS_LIST[grade])
+        if record_type == "班級整體表現":
+            col1, col2 = st.columns(2)
+            with col1: grade = st.selectbox("👉 先選年級", ["一年級", "二年級", "三年級"])
+            with col2: selected_class = st.selectbox("👉 再選班級", REAL_CLASS_LIST[grade])
             
-        student_id, student_name, seat_num = "-", "-", "-"
-        status_category = st.selectbox("🎯 請選擇班級狀況", ["秩序良好 (+1)", "午休良好 (+1)", "導師入班 (+1)", "上課吵鬧/秩序不佳 (-1)", "午休吵鬧 (-1)", "環境髒亂 (-1)", "未節電 (-1)", "其他 (自行輸入)"])
-        if status_category == "其他 (自行輸入)":
-            status = st.text_input("請輸入補充說明：")
-            score_action = st.radio("計分方式", ["加 1 分", "扣 1 分", "不計分"], horizontal=True)
-            score_num = 1 if score_action == "加 1 分" else (-1 if score_action == "扣 1 分" else 0)
-        else:
-            status = status_category.split(" (")[0]
-            score_num = 1 if "(+1)" in status_category else -1
-    else:
-        col_id, col_status = st.columns(2)
-        with col_id:
-            student_id = st.text_input("請輸入學生學號 (限6碼)：").replace(" ", "")
-            if len(student_id) == 6 and student_id in student_db:
-                info = student_db[student_id]
-                selected_class, student_name, seat_num = info.get("班級","-"), info.get("姓名","-"), info.get("座號","-")
-                st.success(f"✅ 查獲：{selected_class} {seat_num}號 {student_name}")
-            else:
-                selected_class, student_name, seat_num = "-", "-", "-"
-                if len(student_id) == 6: st.error("⚠️ 查無此學號！")
-        with col_status:
-            status_category = st.selectbox("🎯 請選擇個人狀況", ["服儀違規-書包/短裙/便服 (0)", "上課遊蕩/去合作社 (-0.03)", "遲到/未到/曠課 (-0.03)", "上課滑手機/睡覺 (-0.03)", "熱心服務/表現優良 (+0.03)", "其他 (自行輸入)"])
+            student_id, student_name, seat_num = "-", "-", "-"
+            status_category = st.selectbox("🎯 請選擇班級狀況", ["秩序良好 (+1)", "午休良好 (+1)", "導師入班 (+1)", "上課吵鬧/秩序不佳 (-1)", "午休吵鬧 (-1)", "環境髒亂 (-1)", "未節電 (-1)", "其他 (自行輸入)"])
             if status_category == "其他 (自行輸入)":
                 status = st.text_input("請輸入補充說明：")
-                score_action = st.radio("計分方式", ["加 0.03 分", "扣 0.03 分", "不計分"], horizontal=True)
-                score_num = 0.03 if score_action == "加 0.03 分" else (-0.03 if score_action == "扣 0.03 分" else 0)
+                score_action = st.radio("計分方式", ["加 1 分", "扣 1 分", "不計分"], horizontal=True)
+                score_num = 1 if score_action == "加 1 分" else (-1 if score_action == "扣 1 分" else 0)
             else:
                 status = status_category.split(" (")[0]
-                if "(+0.03)" in status_category: score_num = 0.03
-                elif "(-0.03)" in status_category: score_num = -0.03
-                else: score_num = 0
-
-    if st.button("➕ 加入下方暫存清單", use_container_width=True):
-        if record_type == "個人違規紀錄" and (len(student_id) != 6 or student_name == "-"):
-            st.error("⚠️ 請務必輸入正確的學號！")
+                score_num = 1 if "(+1)" in status_category else -1
         else:
-            st.session_state.temp_records.append({
-                "日期": today_date, "時間": time_period, "對象": "個人" if record_type == "個人違規紀錄" else "班級",
-                "班級": selected_class, "座號": seat_num, "學號": student_id, "姓名": student_name, "狀況": status, "得分": score_num,
-                "回報人": f"{st.session_state.current_user['name']}"
-            })
+            col_id, col_status = st.columns(2)
+            with col_id:
+                if record_type == "個人違規紀錄":
+                    student_id = st.text_input("請輸入學生學號 (限6碼)：").replace(" ", "")
+                    if len(student_id) == 6 and student_id in roster:
+                        info = roster.get(student_id)
+                        selected_class, student_name, seat_num = info.get("班級","-"), info.get("姓名","-"), info.get("座號","-")
+                        st.success(f"✅ 查獲：{selected_class} {seat_num}號 {student_name}")
+                    else:
+                        selected_class, student_name, seat_num = "-", "-", "-"
+                        if len(student_id) == 6: st.error("⚠️ 查無此學號！")
+                else:
+                    # 批次模式：貼上或以條碼槍連續掃描多個學號，或上傳 CSV (取「學號」欄，沒有則取第一欄)
+                    pasted = st.text_area("貼上/掃描學號 (以換行、空白或逗號分隔)：", height=150)
+                    uploaded = st.file_uploader("或上傳學號 CSV", type="csv")
+                    batch_ids = [t for t in re.split(r"[\s,;，、]+", pasted) if t]
+                    if uploaded is not None:
+                        try: batch_ids += read_id_csv(uploaded.getvalue())
+                        except ValueError as e: st.error(f"⚠️ 無法讀取上傳的檔案：{e}")
+                    batch_students, unknown_ids = roster.lookup_many(batch_ids)
+                    if batch_students: st.success(f"✅ 查獲 {len(batch_students)} 位學生")
+                    if unknown_ids: st.error(f"⚠️ 查無以下 {len(unknown_ids)} 個學號：" + "、".join(unknown_ids))
+            with col_status:
+                status_category = st.selectbox("🎯 請選擇個人狀況", ["服儀違規-書包/短裙/便服 (0)", "上課遊蕩/去合作社 (-0.03)", "遲到/未到/曠課 (-0.03)", "上課滑手機/睡覺 (-0.03)", "熱心服務/表現優良 (+0.03)", "其他 (自行輸入)"])
+                if status_category == "其他 (自行輸入)":
+                    status = st.text_input("請輸入補充說明：")
+                    score_action = st.radio("計分方式", ["加 0.03 分", "扣 0.03 分", "不計分"], horizontal=True)
+                    score_num = 0.03 if score_action == "加 0.03 分" else (-0.03 if score_action == "扣 0.03 分" else 0)
+                else:
+                    status = status_category.split(" (")[0]
+                    if "(+0.03)" in status_category: score_num = 0.03
+                    elif "(-0.03)" in status_category: score_num = -0.03
+                    else: score_num = 0
+            if record_type == "個人違規紀錄" and student_name != "-": student_profile(student_id, "patrol")
 
-    if len(st.session_state.temp_records) > 0:
-        st.markdown("### 🛒 待上傳的暫存紀錄")
-        st.dataframe(pd.DataFrame(st.session_state.temp_records), use_container_width=True)
-        col_up, col_clr = st.columns(2)
-        with col_up:
-            if st.button("🚀 確認無誤，全數寫入", type="primary", use_container_width=True):
-                ws = get_sheet_for_writing("巡查紀錄")
-                upload_data = [[r["日期"], r["時間"], r["對象"], r["班級"], r["座號"], r["學號"], r["姓名"], r["狀況"], r["得分"], r["回報人"]] for r in st.session_state.temp_records]
-                ws.append_rows(upload_data)
-                load_log_data.clear() 
-                st.session_state.temp_records = []
-                st.success("✅ 資料寫入成功！")
-                st.rerun() 
-        with col_clr:
-            if st.button("🗑️ 清空暫存區", use_container_width=True):
-                st.session_state.temp_records = []
-                st.rerun()
+        if st.button("➕ 加入下方暫存清單", use_container_width=True):
+            if record_type == "多位學生批次登記":
+                if not batch_students:
+                    st.error("⚠️ 請先輸入至少一個正確的學號！")
+                else:
+                    reporter = f"{st.session_state.current_user['name']}"
+                    st.session_state.temp_records.extend({
+                        "日期": today_date, "時間": time_period, "對象": "個人", "班級": r["班級"], "座號": r["座號"], "學號": r["學號"],
+                        "姓名": r["姓名"], "狀況": status, "得分": score_num, "回報人": reporter,
+                    } for r in batch_students)
+            elif record_type == "個人違規紀錄" and (len(student_id) != 6 or student_name == "-"):
+                st.error("⚠️ 請務必輸入正確的學號！")
+            else:
+                st.session_state.temp_records.append({
+                    "日期": today_date, "時間": time_period, "對象": "個人" if record_type == "個人違規紀錄" else "班級",
+                    "班級": selected_class, "座號": seat_num, "學號": student_id, "姓名": student_name, "狀況": status, "得分": score_num,
+                    "回報人": f"{st.session_state.current_user['name']}"
+                })
+
+        if len(st.session_state.temp_records) > 0:
+            st.markdown("### 🛒 待上傳的暫存紀錄")
+            st.dataframe(pd.DataFrame(st.session_state.temp_records), use_container_width=True)
+            col_up, col_clr = st.columns(2)
+            with col_up:
+                if st.button("🚀 確認無誤，全數寫入", type="primary", use_container_width=True):
+                    upload_data = [[r["日期"], r["時間"], r["對象"], r["班級"], r["座號"], r["學號"], r["姓名"], r["狀況"], r["得分"], r["回報人"]] for r in st.session_state.temp_records]
+                    batch_id = append_log_rows("巡查紀錄", upload_data)
+                    st.session_state.write_batches.append((batch_id, f"巡查紀錄 {len(upload_data)} 筆"))
+                    st.session_state.temp_records = []
+                    st.success("📨 已送出，資料將於背景寫入！")
+                    st.rerun() 
+            with col_clr:
+                if st.button("🗑️ 清空暫存區", use_container_width=True):
+                    st.session_state.temp_records = []
+                    st.rerun()
 
-# ==========================================
-# 模組二：僑生假單申請
-# ==========================================
-elif app_mode == "📝 僑生假單申請":
-    st.header("📝 僑生外散宿申請單 (週報表整合模式)")
-    user = st.session_state.current_user
+    # ==========================================
+    # 模組二：僑生假單申請
+    # ==========================================
+    elif app_mode == "📝 僑生假單申請":
+        st.header("📝 僑生外散宿申請單 (週報表整合模式)")
+        user = st.session_state.current_user
     
-    # 限制選單選項與預設值
-    target_class = st.selectbox("請選擇要操作的班級", OVERSEAS_CLASSES) if user["role"] == "管理員" else user["class"]
+        # 限制選單選項與預設值
+        target_class = st.selectbox("請選擇要操作的班級", OVERSEAS_CLASSES) if user["role"] == "管理員" else user["class"]
     
-    if not df_students.empty and "班級" in df_students.columns:
-        class_students = df_students[df_students["班級"] == target_class].copy()
-    else:
-        class_students = pd.DataFrame()
+        # 晚間點名：由請假區間索引直接查出指定日期在外的學生
+        with st.expander("🌙 晚間點名：今日請假在外的學生"):
+            r1, r2 = st.columns(2)
+            with r1: roll_date = st.date_input("點名日期", value=tw_time, key="roll_date")
+            with r2: roll_all = user["role"] == "管理員" and st.checkbox("顯示全部僑生班級", key="roll_all")
+            df_out = leaves_on(str(roll_date), OVERSEAS_CLASSES if roll_all else [target_class])
+            if df_out.empty: st.info("🟢 此日期沒有請假在外的學生。")
+            else:
+                st.metric("在外人數", df_out["學號"].nunique())
+                st.dataframe(as_text(df_out[["班級", "座號", "姓名", "類別", "起點日期", "迄止日期", "細節與時間", "外宿地點"]]), use_container_width=True, hide_index=True)
     
-    if class_students.empty:
-        st.warning(f"⚠️ 雲端名單資料庫中查無 {target_class} 的學生資料。")
-    else:
-        class_students["顯示名稱"] = class_students["座號"] + "-" + class_students["姓名"]
-        with st.expander("第一步：設定假別並加入本週清單", expanded=True):
-            selected_display = st.multiselect("選擇本次設定的學生：", class_students["顯示名稱"].tolist())
-            selected_data = class_students[class_students["顯示名稱"].isin(selected_display)]
+        class_students = roster.class_students(target_class)
+    
+        if not class_students:
+            st.warning(f"⚠️ 雲端名單資料庫中查無 {target_class} 的學生資料。")
+        else:
+            with st.expander("第一步：設定假別並加入本週清單", expanded=True):
+                selected_display = st.multiselect("選擇本次設定的學生：", roster.display_names(target_class))
+                selected_data = roster.pick(target_class, selected_display)
             
-            c1, c2 = st.columns(2)
-            with c1:
-                l_type = st.selectbox("申請項目", ["晚歸", "外宿", "返鄉", "職場實習", "打工", "其他"])
-                start_dt = st.date_input("起始日期", value=tw_time)
-            with c2:
-                end_dt = st.date_input("結束日期", value=tw_time)
-                l_time = st.time_input("預計返校時間", value=datetime.strptime("22:00", "%H:%M").time())
+                c1, c2 = st.columns(2)
+                with c1:
+                    l_type = st.selectbox("申請項目", ["晚歸", "外宿", "返鄉", "職場實習", "打工", "其他"])
+                    start_dt = st.date_input("起始日期", value=tw_time)
+                with c2:
+                    end_dt = st.date_input("結束日期", value=tw_time)
+                    l_time = st.time_input("預計返校時間", value=datetime.strptime("22:00", "%H:%M").time())
             
-            stay_info, stay_loc, time_valid = "", "", True
-            if l_type == "晚歸" and l_time > datetime.strptime("22:30", "%H:%M").time():
-                st.error("❌ 晚歸時間不得超過 22:30！")
-                time_valid = False
-            elif l_type == "外宿":
-                sc1, sc2, sc3, sc4 = st.columns(4)
-                with sc1: stay_loc = st.text_input("外宿地點")
-                with sc2: rel_name = st.text_input("親友姓名")
-                with sc3: rel_type = st.text_input("關係")
-                with sc4: rel_tel = st.text_input("親友聯絡電話")
-                stay_info = f"親友:{rel_name}({rel_type}) / 電話:{rel_tel}"
+                stay_info, stay_loc, time_valid = "", "", True
+                if l_type == "晚歸" and l_time > datetime.strptime("22:30", "%H:%M").time():
+                    st.error("❌ 晚歸時間不得超過 22:30！")
+                    time_valid = False
+                elif l_type == "外宿":
+                    sc1, sc2, sc3, sc4 = st.columns(4)
+                    with sc1: stay_loc = st.text_input("外宿地點")
+                    with sc2: rel_name = st.text_input("親友姓名")
+                    with sc3: rel_type = st.text_input("關係")
+                    with sc4: rel_tel = st.text_input("親友聯絡電話")
+                    stay_info = f"親友:{rel_name}({rel_type}) / 電話:{rel_tel}"
                 
-            reason = st.text_input("事由補充說明")
+                reason = st.text_input("事由補充說明")
             
-            if st.button("➕ 加入本週整合清單", use_container_width=True) and time_valid:
-                if selected_data.empty: st.warning("請至少選擇一位學生！")
-                else:
-                    for _, s in selected_data.iterrows():
-                        st.session_state.leave_cart.append({
-                            "班級": target_class, "座號": s.get('座號',''), "學號": s.get('學號',''), "姓名": s.get('姓名',''),
-                            "學生手機": s.get('學生手機',''), "家長電話": s.get('家長聯絡電話',''), "類別": l_type, "起訖日期": f"{start_dt} ~ {end_dt}", 
-                            "返校時間": "21:00點名" if l_type == "外宿" else l_time.strftime('%H:%M'),
-                            "事由與細節": reason + (f" | {stay_loc}" if l_type == "外宿" else ""),
-                            "親友資訊": stay_info if l_type == "外宿" else "-",
-                            "raw_start": str(start_dt), "raw_end": str(end_dt), "raw_reason": f"返校:{l_time.strftime('%H:%M')} / {reason}", "raw_loc": stay_loc, "raw_info": stay_info
-                        })
-                    st.success("✅ 已加入清單！")
-                    st.rerun()
+                allow_overlap = st.checkbox("與既有假單日期重疊時仍加入", key="leave_allow_overlap")
+                if st.button("➕ 加入本週整合清單", use_container_width=True) and time_valid:
+                    # 同一學號的假單日期重疊 (已送出的紀錄或清單中尚未送出的)
+                    overlaps = []
+                    for s in selected_data:
+                        for _, r in as_text(leave_conflicts(s['學號'], start_dt, end_dt)).iterrows():
+                            overlaps.append(f"{s['顯示名稱']}：已有 {r['起點日期']} ~ {r['迄止日期']} {r['類別']} (紀錄日期 {r['紀錄日期']})")
+                        for r in st.session_state.leave_cart:
+                            if r['學號'] == s['學號'] and r['raw_start'] <= str(end_dt) and r['raw_end'] >= str(start_dt):
+                                overlaps.append(f"{s['顯示名稱']}：清單中已有 {r['起訖日期']} {r['類別']}")
+                    if not selected_data: st.warning("請至少選擇一位學生！")
+                    elif overlaps and not allow_overlap:
+                        st.warning("⚠️ 以下學生的請假日期與既有假單重疊，請確認後勾選「仍加入」：\n\n" + "\n".join(f"- {o}" for o in overlaps))
+                    else:
+                        for s in selected_data:
+                            st.session_state.leave_cart.append({
+                                "班級": target_class, "座號": s.get('座號',''), "學號": s.get('學號',''), "姓名": s.get('姓名',''),
+                                "學生手機": s.get('學生手機',''), "家長電話": s.get('家長聯絡電話',''), "類別": l_type, "起訖日期": f"{start_dt} ~ {end_dt}", 
+                                "返校時間": "21:00點名" if l_type == "外宿" else l_time.strftime('%H:%M'),
+                                "事由與細節": reason + (f" | {stay_loc}" if l_type == "外宿" else ""),
+                                "親友資訊": stay_info if l_type == "外宿" else "-",
+                                "raw_start": str(start_dt), "raw_end": str(end_dt), "raw_reason": f"返校:{l_time.strftime('%H:%M')} / {reason}", "raw_loc": stay_loc, "raw_info": stay_info
+                            })
+                        st.success("✅ 已加入清單！")
+                        st.rerun()
 
-        if len(st.session_state.leave_cart) > 0:
-            st.markdown("### 🛒 假單總表預覽")
-            st.dataframe(pd.DataFrame(st.session_state.leave_cart)[["座號", "姓名", "類別", "起訖日期", "返校時間", "事由與細節"]], use_container_width=True)
-            col_s, col_c = st.columns(2)
-            with col_s:
-                if st.button("🚀 確認寫入並產製假單 PDF", type="primary", use_container_width=True):
-                    ws = get_sheet_for_writing("僑生請假紀錄", ["紀錄日期", "班級", "座號", "學號", "姓名", "類別", "起點日期", "迄止日期", "細節與時間", "外宿地點", "親友/關係/電話", "經辦人"])
-                    upload_rows = [[today_date, r['班級'], r['座號'], r['學號'], r['姓名'], r['類別'], r['raw_start'], r['raw_end'], r['raw_reason'], r['raw_loc'], r['raw_info'], user['name']] for r in st.session_state.leave_cart]
-                    ws.append_rows(upload_rows)
-                    load_log_data.clear()
+            if len(st.session_state.leave_cart) > 0:
+                st.markdown("### 🛒 假單總表預覽")
+                st.dataframe(pd.DataFrame(st.session_state.leave_cart)[["座號", "姓名", "類別", "起訖日期", "返校時間", "事由與細節"]], use_container_width=True)
+                col_s, col_c = st.columns(2)
+                with col_s:
+                    if st.button("🚀 確認寫入並產製假單 PDF", type="primary", use_container_width=True):
+                        upload_rows = [[today_date, r['班級'], r['座號'], r['學號'], r['姓名'], r['類別'], r['raw_start'], r['raw_end'], r['raw_reason'], r['raw_loc'], r['raw_info'], user['name']] for r in st.session_state.leave_cart]
+                        batch_id = append_log_rows("僑生請假紀錄", upload_rows)
+                        st.session_state.write_batches.append((batch_id, f"{target_class} 假單 {len(upload_rows)} 筆"))
                     
-                    rows_html = "".join([f"<tr><td>{r['座號']}</td><td>{r['姓名']}</td><td>{r['類別']}</td><td>{r['起訖日期']}</td><td>{r['返校時間']}</td><td>{r['事由與細節']}<br>{r['親友資訊']}</td><td>{r['學生手機']}</td><td>{r['家長電話']}</td></tr>" for r in st.session_state.leave_cart])
-                    st.session_state.print_leave_html = f"""
-                    <!DOCTYPE html><html><head><meta charset="utf-8"><style>
-                        body {{ font-family: "Microsoft JhengHei", sans-serif; padding: 20px; }}
-                        @media print {{ #btn {{ display: none !important; }} @page {{ size: A4 landscape; margin: 15mm; }} }}
-                        #btn {{ margin-bottom: 20px; padding: 12px; background: #FF4B4B; color: white; border: none; width: 100%; font-size: 18px; font-weight: bold; cursor: pointer; }}
-                        .title {{ text-align: center; font-size: 24px; font-weight: bold; margin-bottom: 20px; border-bottom: 2px solid black; padding-bottom: 10px; }}
-                        table {{ width: 100%; border-collapse: collapse; font-size: 13px; }} th, td {{ border: 1px solid black; padding: 8px; text-align: center; }} th {{ background-color: #f2f2f2; }}
-                        .sig {{ display: flex; justify-content: space-between; margin-top: 80px; }} .box {{ text-align: center; width: 18%; font-weight: bold; font-size: 16px; }}
-                    </style></head><body>
-                        <button id="btn" onclick="window.print()">🖨️ 點此列印 (請存為 PDF)</button>
-                        <div class="title">樹人家商 {target_class} 僑生外散(宿)集體申請單</div>
-                        <table><thead><tr><th>座號</th><th>姓名</th><th>類別</th><th>申請日期</th><th>返校/宿時間</th><th>地點/事由/親友資訊</th><th>學生手機</th><th>家長電話</th></tr></thead><tbody>{rows_html}</tbody></table>
-                        <div class="sig"><div class="box">導師<br><br></div><div class="box">生輔組長<br><br></div><div class="box">學務主任<br><br></div><div class="box">國際交流組<br><br></div><div class="box">招生中心<br><br></div></div>
-                    </body></html>
-                    """
-                    st.session_state.leave_cart = [] 
-                    st.rerun()
-            with col_c:
-                if st.button("🗑️ 清空清單", use_container_width=True):
-                    st.session_state.leave_cart = []
-                    st.rerun()
+                        st.session_state.print_leave = {"rows": st.session_state.leave_cart, "class_name": target_class}
+                        st.session_state.leave_cart = [] 
+                        st.rerun()
+                with col_c:
+                    if st.button("🗑️ 清空清單", use_container_width=True):
+                        st.session_state.leave_cart = []
+                        st.rerun()
 
-        if "print_leave_html" in st.session_state:
-            st.divider()
-            components.html(st.session_state.print_leave_html, height=800, scrolling=True)
+            if "print_leave" in st.session_state:
+                st.divider()
+                components.html(reports.leave_form(**st.session_state.print_leave), height=800, scrolling=True)
 
-# ==========================================
-# 模組三：獎懲建議單申請
-# ==========================================
-elif app_mode == "🏆 獎懲建議單申請":
-    st.header("🏆 獎懲建議單申請作業")
-    user = st.session_state.current_user
+    # ==========================================
+    # 模組三：獎懲建議單申請
+    # ==========================================
+    elif app_mode == "🏆 獎懲建議單申請":
+        st.header("🏆 獎懲建議單申請作業")
+        user = st.session_state.current_user
     
-    rules_dict = {}
-    if not df_rules.empty:
-        for col in df_rules.columns:
-            rules_dict[col] = [r for r in df_rules[col].dropna().tolist() if str(r).strip() != ""]
+        st.markdown("### 第一步：選擇學生")
+        input_mode = st.radio("作業模式", ["📌 本班學生 (下拉勾選)", "🏫 依年級/班級搜尋 (跨班利器)", "🔍 輸入學號搜尋"], horizontal=True)
     
-    st.markdown("### 第一步：選擇學生")
-    input_mode = st.radio("作業模式", ["📌 本班學生 (下拉勾選)", "🏫 依年級/班級搜尋 (跨班利器)", "🔍 輸入學號搜尋"], horizontal=True)
+        selected_students = []
     
-    selected_students = pd.DataFrame()
-    
-    if input_mode == "📌 本班學生 (下拉勾選)":
-        if user["class"] == "全校":
-            st.warning("💡 您目前為全校權限(非班級導師)，請使用「依年級/班級搜尋」或「輸入學號」模式。")
-        else:
-            if not df_students.empty and "班級" in df_students.columns:
-                class_students = df_students[df_students["班級"] == user["class"]].copy()
+        if input_mode == "📌 本班學生 (下拉勾選)":
+            if user["class"] == "全校":
+                st.warning("💡 您目前為全校權限(非班級導師)，請使用「依年級/班級搜尋」或「輸入學號」模式。")
             else:
-                class_students = pd.DataFrame()
+                if roster.class_students(user["class"]):
+                    selected_display = st.multiselect("請勾選本班學生：", roster.display_names(user["class"]))
+                    selected_students = roster.pick(user["class"], selected_display)
+                else: st.error(f"查無 {user['class']} 學生資料，請確認雲端名單。")
                 
-            if not class_students.empty:
-                class_students["顯示名稱"] = class_students["座號"] + "-" + class_students["姓名"]
-                selected_display = st.multiselect("請勾選本班學生：", class_students["顯示名稱"].tolist())
-                selected_students = class_students[class_students["顯示名稱"].isin(selected_display)]
-            else: st.error(f"查無 {user['class']} 學生資料，請確認雲端名單。")
-                
-    elif input_mode == "🏫 依年級/班級搜尋 (跨班利器)":
-        col_g, col_c = st.columns(2)
-        with col_g: search_grade = st.selectbox("👉 1. 選擇年級", ["一年級", "二年級", "三年級"])
-        with col_c: search_class = st.selectbox("👉 2. 選擇班級", REAL_CLASS_LIST[search_grade])
-            
-        if not df_students.empty and "班級" in df_students.columns:
-            class_students = df_students[df_students["班級"] == search_class].copy()
-        else:
-            class_students = pd.DataFrame()
+        elif input_mode == "🏫 依年級/班級搜尋 (跨班利器)":
+            col_g, col_c = st.columns(2)
+            with col_g: search_grade = st.selectbox("👉 1. 選擇年級", ["一年級", "二年級", "三年級"])
+            with col_c: search_class = st.selectbox("👉 2. 選擇班級", REAL_CLASS_LIST[search_grade])
             
-        if not class_students.empty:
-            class_students["顯示名稱"] = class_students["座號"] + "-" + class_students["姓名"]
-            selected_display = st.multiselect(f"👉 3. 請勾選 {search_class} 學生 (可多選)：", class_students["顯示名稱"].tolist())
-            selected_students = class_students[class_students["顯示名稱"].isin(selected_display)]
-        else: st.warning(f"名單資料庫中查無 {search_class} 的學生資料。")
+            if roster.class_students(search_class):
+                selected_display = st.multiselect(f"👉 3. 請勾選 {search_class} 學生 (可多選)：", roster.display_names(search_class))
+                selected_students = roster.pick(search_class, selected_display)
+            else: st.warning(f"名單資料庫中查無 {search_class} 的學生資料。")
             
-    else: 
-        search_id = st.text_input("請輸入學生學號 (限6碼)：").strip()
-        if len(search_id) == 6:
-            if search_id in student_db:
-                st.success(f"✅ 查獲學生：{student_db[search_id]['班級']} {student_db[search_id]['姓名']}")
-                selected_students = pd.DataFrame([student_db[search_id]])
-            else: st.error("⚠️ 查無此學號！")
+        else: 
+            search_id = st.text_input("請輸入學生學號 (限6碼)：").strip()
+            if len(search_id) == 6:
+                if search_id in roster:
+                    found = roster.get(search_id)
+                    st.success(f"✅ 查獲學生：{found['班級']} {found['姓名']}")
+                    selected_students = [found]
+                    student_profile(search_id, "reward")
+                else: st.error("⚠️ 查無此學號！")
 
-    if not selected_students.empty:
-        st.markdown("### 第二步：設定獎懲內容")
-        rc1, rc2, rc3 = st.columns([2, 4, 1])
-        with rc1: 
-            r_type = st.selectbox("獎懲類別", list(rules_dict.keys()) if rules_dict else ["嘉獎", "小功", "大功", "警告", "小過", "大過"])
-        with rc2: 
-            r_reason = st.selectbox("引用條文/事由", rules_dict.get(r_type, ["無內建法規，請聯絡管理員更新試算表"]))
-        with rc3: 
-            r_count = st.selectbox("建議次數", ["乙次", "兩次", "三次"])
+        if selected_students:
+            st.markdown("### 第二步：設定獎懲內容")
+            rc1, rc2, rc3 = st.columns([2, 4, 1])
+            with rc1: 
+                r_type = st.selectbox("獎懲類別", list(rules_dict.keys()) if rules_dict else ["嘉獎", "小功", "大功", "警告", "小過", "大過"])
+            with rc2: 
+                r_reason = st.selectbox("引用條文/事由", rules_dict.get(r_type, ["無內建法規，請聯絡管理員更新試算表"]))
+            with rc3: 
+                r_count = st.selectbox("建議次數", ["乙次", "兩次", "三次"])
             
-        if st.button("➕ 將以上設定加入下方建議清單", use_container_width=True):
-            for _, s in selected_students.iterrows():
-                st.session_state.reward_cart.append({
-                    "類別": "獎勵" if r_type in ["嘉獎", "小功", "大功"] else "懲處",
-                    "學號": s['學號'], "班級": s['班級'], "座號姓名": f"{s.get('座號','')}{s.get('姓名','')}",
-                    "獎懲項目": r_type, "事由": r_reason, "建議次數": r_count, "導師簽名": user["name"]
-                })
-            st.success("✅ 已加入清單！")
-            st.rerun() 
+            if st.button("➕ 將以上設定加入下方建議清單", use_container_width=True):
+                for s in selected_students:
+                    st.session_state.reward_cart.append({
+                        "類別": "獎勵" if r_type in ["嘉獎", "小功", "大功"] else "懲處",
+                        "學號": s['學號'], "班級": s['班級'], "座號姓名": f"{s.get('座號','')}{s.get('姓名','')}",
+                        "獎懲項目": r_type, "事由": r_reason, "建議次數": r_count, "導師簽名": user["name"]
+                    })
+                st.success("✅ 已加入清單！")
+                st.rerun() 
 
-    if len(st.session_state.reward_cart) > 0:
-        st.markdown("### 🛒 待送出之獎懲建議清單 (跨班總結算)")
-        st.dataframe(pd.DataFrame(st.session_state.reward_cart), use_container_width=True)
-        col_s, col_c = st.columns(2)
-        with col_s:
-            if st.button("🚀 確認無誤，寫入並產製 PDF 建議單", type="primary", use_container_width=True):
-                ws = get_sheet_for_writing("獎懲紀錄總表", ["日期", "類別", "學號", "班級", "座號姓名", "獎懲項目", "事由", "建議次數", "導師簽名"])
-                upload_rows = [[today_date, r['類別'], r['學號'], r['班級'], r['座號姓名'], r['獎懲項目'], r['事由'], r['建議次數'], r['導師簽名']] for r in st.session_state.reward_cart]
-                ws.append_rows(upload_rows)
-                load_log_data.clear()
+        if len(st.session_state.reward_cart) > 0:
+            st.markdown("### 🛒 待送出之獎懲建議清單 (跨班總結算)")
+            st.dataframe(pd.DataFrame(st.session_state.reward_cart), use_container_width=True)
+            col_s, col_c = st.columns(2)
+            with col_s:
+                if st.button("🚀 確認無誤，寫入並產製 PDF 建議單", type="primary", use_container_width=True):
+                    upload_rows = [[today_date, r['類別'], r['學號'], r['班級'], r['座號姓名'], r['獎懲項目'], r['事由'], r['建議次數'], r['導師簽名']] for r in st.session_state.reward_cart]
+                    batch_id = append_log_rows("獎懲紀錄總表", upload_rows)
+                    st.session_state.write_batches.append((batch_id, f"獎懲建議 {len(upload_rows)} 筆"))
                 
-                main_type = "獎勵" if st.session_state.reward_cart[0]['類別'] == "獎勵" else "懲處"
-                rows_html = "".join([f"<tr><td>{idx+1}</td><td>{r['學號']}</td><td>{r['班級']}</td><td>{r['座號姓名']}</td><td>{r['獎懲項目']}</td><td style='text-align:left;'>{r['事由']}</td><td>{r['建議次數']}</td><td>{r['導師簽名']}</td></tr>" for idx, r in enumerate(st.session_state.reward_cart)])
-                st.session_state.print_reward_html = f"""
-                <!DOCTYPE html><html><head><meta charset="utf-8"><style>
-                    body {{ font-family: "Microsoft JhengHei", sans-serif; padding: 20px; }}
-                    @media print {{ #btn {{ display: none !important; }} @page {{ size: A4 portrait; margin: 15mm; }} }}
-                    #btn {{ margin-bottom: 20px; padding: 12px; background: #FF4B4B; color: white; border: none; width: 100%; font-size: 18px; font-weight: bold; cursor: pointer; }}
-                    .title {{ text-align: center; font-size: 24px; font-weight: bold; margin-bottom: 5px; }}
-                    .subtitle {{ text-align: right; font-size: 14px; margin-bottom: 10px; }}
-                    table {{ width: 100%; border-collapse: collapse; font-size: 14px; }} th, td {{ border: 1px solid black; padding: 10px; text-align: center; }} th {{ background-color: #f2f2f2; }}
-                    .sig {{ display: flex; justify-content: space-between; margin-top: 60px; }} .box {{ text-align: center; width: 22%; font-weight: bold; font-size: 16px; border-top: 1px dotted black; padding-top: 10px; }}
-                </style></head><body>
-                    <button id="btn" onclick="window.print()">🖨️ 點此列印 {main_type}建議單</button>
-                    <div class="title">新北市私立樹人家商{main_type}建議單</div>
-                    <div class="subtitle">造冊日期：{today_date}</div>
-                    <table><thead><tr><th width="5%">項次</th><th width="12%">學號</th><th width="12%">班級</th><th width="12%">座號姓名</th><th width="10%">類別</th><th width="35%">獎懲事由</th><th width="7%">建議</th><th width="7%">簽名</th></tr></thead><tbody>{rows_html}</tbody></table>
-                    <div class="sig"><div class="box">簽辦人</div><div class="box">輔導教官</div><div class="box">主任教官</div><div class="box">學務主任</div></div>
-                </body></html>
-                """
-                st.session_state.reward_cart = [] 
-                st.rerun()
-        with col_c:
-            if st.button("🗑️ 清空清單", use_container_width=True):
-                st.session_state.reward_cart = []
-                st.rerun()
+                    st.session_state.print_reward = {"rows": st.session_state.reward_cart, "report_date": today_date}
+                    st.session_state.reward_cart = [] 
+                    st.rerun()
+            with col_c:
+                if st.button("🗑️ 清空清單", use_container_width=True):
+                    st.session_state.reward_cart = []
+                    st.rerun()
 
-    if "print_reward_html" in st.session_state:
-        st.divider()
-        components.html(st.session_state.print_reward_html, height=800, scrolling=True)
+        if "print_reward" in st.session_state:
+            st.divider()
+            components.html(reports.reward_form(**st.session_state.print_reward), height=800, scrolling=True)
 
-# ==========================================
-# 模組四：綜合數據中心
-# ==========================================
-elif app_mode == "📊 綜合數據中心 (管理員專屬)":
-    st.header("📊 綜合數據中心")
-    if "current_user" not in st.session_state or st.session_state.current_user is None: st.stop()
+    # ==========================================
+    # 模組四：綜合數據中心
+    # ==========================================
+    elif app_mode == "📊 綜合數據中心 (管理員專屬)":
+        st.header("📊 綜合數據中心")
+        if "current_user" not in st.session_state or st.session_state.current_user is None: st.stop()
         
-    tab1, tab2, tab3, tab4 = st.tabs(["🔥 巡查資料庫", "✈️ 僑生假單總表", "🏆 獎懲紀錄總表", "🖨️ 產製今日呈核報表"])
+        # 分頁改為選到才執行 (on_change="rerun" + tab.open)，開啟數據中心只需載入目前分頁的資料
+        tab1, tab2, tab3, tab4, tab5, tab6 = st.tabs(["🔥 巡查資料庫", "✈️ 僑生假單總表", "🏆 獎懲紀錄總表", "🖨️ 產製今日呈核報表", "🏅 班級排行榜", "📈 效能監控"],
+                                                      key="data_center_tab", on_change="rerun")
     
-    with tab1:
-        st.subheader("巡查紀錄維護")
-        df_patrol = load_log_data("巡查紀錄")
-        if not df_patrol.empty:
-            edited_df = st.data_editor(df_patrol, num_rows="dynamic", use_container_width=True, height=400)
-            if st.button("💾 儲存巡查修改", type="primary"):
-                ws = get_sheet_for_writing("巡查紀錄")
-                ws.clear()
-                ws.update(values=[edited_df.columns.tolist()] + edited_df.fillna("").values.tolist(), range_name='A1')
-                load_log_data.clear()
-                st.success("✅ 資料庫已更新！")
-        else: st.info("無紀錄。")
-            
-    with tab2:
-        st.subheader("僑生請假總表")
-        df_leave = load_log_data("僑生請假紀錄")
-        if not df_leave.empty:
-            edited_leave_df = st.data_editor(df_leave, num_rows="dynamic", use_container_width=True, height=400)
-            if st.button("💾 儲存假單修改", type="primary"):
-                ws = get_sheet_for_writing("僑生請假紀錄")
-                ws.clear()
-                ws.update(values=[edited_leave_df.columns.tolist()] + edited_leave_df.fillna("").values.tolist(), range_name='A1')
-                load_log_data.clear()
-                st.success("✅ 資料庫已更新！")
-        else: st.info("無紀錄。")
-
-    with tab3:
-        st.subheader("全校獎懲建議紀錄表")
-        df_rewards = load_log_data("獎懲紀錄總表")
-        if not df_rewards.empty:
-            edited_rewards_df = st.data_editor(df_rewards, num_rows="dynamic", use_container_width=True, height=400)
-            col_r1, col_r2 = st.columns(2)
-            with col_r1:
-                if st.button("💾 儲存獎懲修改", type="primary"):
-                    ws = get_sheet_for_writing("獎懲紀錄總表")
-                    ws.clear()
-                    ws.update(values=[edited_rewards_df.columns.tolist()] + edited_rewards_df.fillna("").values.tolist(), range_name='A1')
-                    load_log_data.clear()
-                    st.success("✅ 獎懲資料庫已更新！")
-            with col_r2:
-                csv = edited_rewards_df.to_csv(index=False).encode('utf-8-sig')
-                st.download_button("📥 下載完整總表", data=csv, file_name=f"獎懲紀錄總表_{today_date}.csv", use_container_width=True)
-        else: st.info("尚無獎懲紀錄。")
+        ALL_CLASSES = [c for cs in REAL_CLASS_LIST.values() for c in cs]
+    
+        # 篩選 + 分頁瀏覽：只有目前這一頁會送到瀏覽器編輯，儲存時依 index 對回工作表的列
+        def log_browser(sheet_name, key):
+            with st.expander("🔎 篩選條件"):
+                f1, f2, f3 = st.columns(3)
+                with f1:
+                    date_from = st.date_input("起始日期", value=None, key=f"{key}_from")
+                    date_to = st.date_input("結束日期", value=None, key=f"{key}_to")
+                with f2:
+                    class_name = st.selectbox("班級", ["全部"] + ALL_CLASSES, key=f"{key}_class")
+                    student_id = st.text_input("學號", key=f"{key}_sid").strip()
+                with f3:
+                    reporter = st.text_input("回報人/經辦人", key=f"{key}_reporter").strip()
+                    status = st.text_input("狀況/類別 (關鍵字)", key=f"{key}_status").strip()
+            filters = dict(date_from=str(date_from) if date_from else None, date_to=str(date_to) if date_to else None,
+                           class_name=None if class_name == "全部" else class_name, student_id=student_id, reporter=reporter, status=status)
+            filtered = query_log(sheet_name, **filters)
+            if filtered.empty: return filtered, None, None
         
-    with tab4:
-        st.subheader("🖨️ 產製今日巡查呈核報表")
-        df_patrol = load_log_data("巡查紀錄")
-        if not df_patrol.empty and '日期' in df_patrol.columns:
-            df_today = df_patrol[df_patrol['日期'] == today_date]
-            if not df_today.empty:
-                df_class = df_today[(df_today['對象'] == '班級') & (~df_today['時間'].str.contains('午休', na=False, regex=False))]
-                df_noon = df_today[(df_today['對象'] == '班級') & (df_today['時間'].str.contains('午休', na=False, regex=False))]
-                df_personal = df_today[df_today['對象'] == '個人']
-                
-                def df_to_html(df, cols):
-                    if df.empty: return "<tr><td colspan='10'>無紀錄</td></tr>"
-                    return "".join(["<tr>" + "".join([f"<td>{r.get(c, '')}</td>" for c in cols]) + "</tr>" for _, r in df.iterrows()])
-                
-                cols_class, cols_personal = ['時間', '班級', '狀況', '得分', '回報人'], ['時間', '班級', '學號', '姓名', '狀況', '得分', '回報人']
+            p1, p2 = st.columns([1, 3])
+            with p1: page_size = st.selectbox("每頁筆數", [50, 100, 200, 500], index=1, key=f"{key}_size")
+            n_pages = (len(filtered) - 1) // page_size + 1
+            with p2: page_no = st.number_input(f"頁數 (共 {n_pages} 頁、{len(filtered)} 筆)", min_value=1, max_value=n_pages, value=n_pages, key=f"{key}_page")
+            page = filtered.iloc[(page_no - 1) * page_size: page_no * page_size]
+            # 換頁或改條件時換一個編輯器 key，避免上一頁的編輯套用到新頁面
+            editor_key = f"{key}_editor_{page_no}_{page_size}_{hash(tuple(filters.values()))}"
+            edited = st.data_editor(as_text(page), num_rows="dynamic", use_container_width=True, height=400, key=editor_key)
+            return filtered, page, edited
+    
+        # 批次匯出列印表單：依日期範圍每班一份，按下下載時才以執行緒池並行產生
+        def batch_print_exporter(kind, key):
+            with st.expander("📦 批次匯出列印表單 (各班)"):
+                b1, b2, b3 = st.columns(3)
+                with b1: date_from = st.date_input("起始日期", value=tw_time.date() - timedelta(days=6), key=f"{key}_batch_from")
+                with b2: date_to = st.date_input("結束日期", value=tw_time.date(), key=f"{key}_batch_to")
+                with b3: fmt = st.radio("輸出格式", ["ZIP (每班一個檔案)", "合併列印檔 (每班一頁)"], key=f"{key}_batch_fmt")
+                span = f"{date_from}_{date_to}"
+                combined = fmt.startswith("合併")
+                name = "僑生外散宿申請單" if kind == "leave" else "獎懲建議單"
+                # 期間放在檔名；建議單上的造冊日期仍是今天
+                def build():
+                    if kind == "leave":
+                        jobs = [(f"{c}_{name}_{span}.html", lambda rows=rows, c=c: reports.leave_form(rows, c))
+                                for c, rows in leave_form_batches(str(date_from), str(date_to))]
+                    else:
+                        jobs = [(f"{c}_{t}建議單_{span}.html", lambda rows=rows: reports.reward_form(rows, today_date))
+                                for c, t, rows in reward_form_batches(str(date_from), str(date_to))]
+                    return reports.export_batch(jobs, combined=combined)
+                st.caption(f"期間 {date_from} ~ {date_to} 的紀錄，每班一份；按下下載時才產生。")
+                st.download_button("📥 下載", data=build,
+                                   file_name=f"{name}_{span}.{'html' if combined else 'zip'}",
+                                   mime="text/html" if combined else "application/zip", use_container_width=True, key=f"{key}_batch_dl")
+    
+        with tab1:
+            if tab1.open:
+                st.subheader("巡查紀錄維護")
+                df_patrol, page_patrol, edited_df = log_browser("巡查紀錄", "patrol")
+                if page_patrol is not None:
+                    if st.button("💾 儲存巡查修改", type="primary"):
+                        n_cells, n_added, n_deleted = save_log_edits("巡查紀錄", page_patrol, edited_df)
+                        st.success(f"✅ 資料庫已更新！(修改 {n_cells} 格、新增 {n_added} 列、刪除 {n_deleted} 列)")
+                else: st.info("無紀錄。")
+                n_closed = closed_month_rows(today_date)
+                if n_closed:
+                    with st.expander(f"🗄️ 封存已結束月份 (共 {n_closed} 筆)"):
+                        st.caption("將上個月以前的巡查紀錄搬到「巡查紀錄封存_YYYY-MM」工作表，主表只保留本月資料。")
+                        if st.button("立即封存", type="primary"):
+                            moved = archive_closed_months(today_date)
+                            st.success("✅ 已封存：" + "、".join(f"{m} {n} 筆" for m, n in moved.items()))
                 
-                report_html = f"""
-                <!DOCTYPE html><html><head><meta charset="utf-8"><style>
-                    body {{ font-family: "Microsoft JhengHei", sans-serif; padding: 20px; }}
-                    @media print {{ #btn-rpt {{ display: none !important; }} @page {{ size: A4 portrait; margin: 15mm; }} }}
-                    #btn-rpt {{ margin-bottom: 20px; padding: 12px; background: #FF4B4B; color: white; border: none; width: 100%; font-size: 18px; font-weight: bold; cursor: pointer; }}
-                    .title {{ text-align: center; font-size: 24px; font-weight: bold; margin-bottom: 20px; border-bottom: 2px solid black; padding-bottom: 10px; }}
-                    h3 {{ margin-top: 20px; font-size: 16px; border-left: 4px solid #333; padding-left: 10px; }}
-                    table {{ width: 100%; border-collapse: collapse; margin-bottom: 15px; font-size: 13px; }} th, td {{ border: 1px solid black; padding: 6px; text-align: center; }} th {{ background-color: #e0e0e0; }}
-                    .sig {{ display: flex; justify-content: space-between; margin-top: 60px; }} .box {{ text-align: center; width: 22%; font-weight: bold; font-size: 16px; border-top: 1px dashed gray; padding-top: 10px; }}
-                </style></head><body>
-                    <button id="btn-rpt" onclick="window.print()">🖨️ 點此列印呈核報表</button>
-                    <div class="title">樹人家商 每日校園巡查呈核紀錄表</div>
-                    <div style="text-align: right; margin-bottom: 10px;">報表日期：{today_date}</div>
-                    <h3>一、 上課巡查紀錄</h3><table><thead><tr><th>時間</th><th>班級</th><th>狀況</th><th>加扣分</th><th>回報人</th></tr></thead><tbody>{df_to_html(df_class, cols_class)}</tbody></table>
-                    <h3>二、 午間巡查紀錄</h3><table><thead><tr><th>時間</th><th>班級</th><th>狀況</th><th>加扣分</th><th>回報人</th></tr></thead><tbody>{df_to_html(df_noon, cols_class)}</tbody></table>
-                    <h3>三、 當日違規學生名單</h3><table><thead><tr><th>時間</th><th>班級</th><th>學號</th><th>姓名</th><th>違規狀況</th><th>加扣分</th><th>回報人</th></tr></thead><tbody>{df_to_html(df_personal, cols_personal)}</tbody></table>
-                    <div class="sig"><div class="box">承辦人</div><div class="box">學務處主管</div><div class="box">教務處主管</div><div class="box">校長</div></div>
-                </body></html>
-                """
-                components.html(report_html, height=800, scrolling=True)
-            else: st.info("🟢 今日尚無紀錄。")
+        with tab2:
+            if tab2.open:
+                st.subheader("僑生請假總表")
+                df_leave, page_leave, edited_leave_df = log_browser("僑生請假紀錄", "leave")
+                if page_leave is not None:
+                    if st.button("💾 儲存假單修改", type="primary"):
+                        n_cells, n_added, n_deleted = save_log_edits("僑生請假紀錄", page_leave, edited_leave_df)
+                        st.success(f"✅ 資料庫已更新！(修改 {n_cells} 格、新增 {n_added} 列、刪除 {n_deleted} 列)")
+                else: st.info("無紀錄。")
+                batch_print_exporter("leave", "leave")
+
+        with tab3:
+            if tab3.open:
+                st.subheader("全校獎懲建議紀錄表")
+                df_rewards, page_rewards, edited_rewards_df = log_browser("獎懲紀錄總表", "rewards")
+                if page_rewards is not None:
+                    col_r1, col_r2 = st.columns(2)
+                    with col_r1:
+                        if st.button("💾 儲存獎懲修改", type="primary"):
+                            n_cells, n_added, n_deleted = save_log_edits("獎懲紀錄總表", page_rewards, edited_rewards_df)
+                            st.success(f"✅ 獎懲資料庫已更新！(修改 {n_cells} 格、新增 {n_added} 列、刪除 {n_deleted} 列)")
+                    with col_r2:
+                        # 傳入函式：按下下載時才產生 CSV
+                        st.download_button("📥 下載總表 (依目前篩選)", data=lambda: df_rewards.to_csv(index=False).encode('utf-8-sig'), file_name=f"獎懲紀錄總表_{today_date}.csv", use_container_width=True)
+                else: st.info("尚無獎懲紀錄。")
+                batch_print_exporter("reward", "rewards")
+            
+        with tab4:
+            if tab4.open:
+                st.subheader("🖨️ 產製今日巡查呈核報表")
+                df_today = load_patrol_partition(today_date)
+                if not df_today.empty:
+                    components.html(reports.daily_patrol_report(as_text(df_today), today_date), height=800, scrolling=True)
+                else: st.info("🟢 今日尚無紀錄。")
+
+        with tab5:
+            if tab5.open:
+                st.subheader("🏅 班級巡查得分排行榜")
+                col_p, col_g = st.columns(2)
+                with col_p: period = st.radio("統計區間", ["本週", "本月", "本學期"], horizontal=True)
+                with col_g: board_grade = st.selectbox("年級", ["全校", "一年級", "二年級", "三年級"])
+                if period == "本週": period_start = (tw_time - timedelta(days=tw_time.weekday())).strftime("%Y-%m-%d")
+                elif period == "本月": period_start = tw_time.strftime("%Y-%m-01")
+                elif tw_time.month >= 8: period_start = f"{tw_time.year}-08-01"
+                elif tw_time.month == 1: period_start = f"{tw_time.year - 1}-08-01"
+                else: period_start = f"{tw_time.year}-02-01"
+                board_classes = [c for g, cs in REAL_CLASS_LIST.items() if board_grade in ("全校", g) for c in cs]
+            
+                scores = load_score_aggregates(period_start, today_date)
+                board = scores.leaderboard(period_start, today_date, board_classes)
+                st.caption(f"📅 {period_start} ~ {today_date}")
+                st.dataframe(board, use_container_width=True, hide_index=True)
+            
+                trend_classes = st.multiselect("📈 得分趨勢 (累計)", board_classes, default=board["班級"].head(5).tolist())
+                if trend_classes:
+                    st.line_chart(scores.trend(period_start, today_date, trend_classes))
+
+        with tab6:
+            if tab6.open:
+                st.subheader("📈 試算表 API 與快取效能")
+                metrics = get_metrics()
+                st.caption(f"🕒 自 {(datetime.utcfromtimestamp(metrics.started) + timedelta(hours=8)).strftime('%Y-%m-%d %H:%M:%S')} 起統計")
+                rerun = metrics.rerun_summary()
+                for col, (label, value) in zip(st.columns(len(rerun)), rerun.items()):
+                    col.metric(f"重跑 {label}", value)
+                calls = metrics.calls_frame()
+                st.markdown("#### API 呼叫 (依累計耗時排序)")
+                st.dataframe(calls, use_container_width=True, hide_index=True)
+                n_429 = int(calls["429"].sum()) if not calls.empty else 0
+                if n_429: st.warning(f"⚠️ 已遇到 {n_429} 次配額限制 (429)，請考慮拉長快取時間或減少整份重讀。")
+                st.markdown("#### 延遲分布")
+                st.bar_chart(metrics.latency_histogram())
+                st.markdown("#### 快取命中率")
+                st.dataframe(metrics.cache_frame(), use_container_width=True, hide_index=True)
+                st.markdown("#### 紀錄表快取記憶體用量")
+                st.dataframe(log_memory_report(), use_container_width=True, hide_index=True)
+                col_m1, col_m2 = st.columns(2)
+                with col_m1:
+                    st.download_button("📥 匯出效能統計 CSV", data=metrics.export_csv, file_name=f"效能統計_{today_date}.csv", use_container_width=True)
+                with col_m2:
+                    if st.button("🧹 重設統計", use_container_width=True):
+                        metrics.reset()
+                        st.rerun()
+finally:
+    record_rerun(time.perf_counter() - rerun_started)
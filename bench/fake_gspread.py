@@ -0,0 +1,166 @@
+import json
+import threading
+import time
+
+import requests
+from gspread.exceptions import APIError
+from gspread.utils import a1_to_rowcol
+
+# ==========================================
+# 記憶體內的 gspread 替身 (離線基準測試用)
+#   只實作 storage.GSheetsBackend 用到的 Client / Spreadsheet / Worksheet 介面，
+#   每次「API 呼叫」依設定睡眠模擬網路延遲，並累計呼叫次數。
+#   工作表有格線列數 (row_count)：讀取超出格線的範圍與真正的 API 一樣回 400。
+# ==========================================
+def _api_error(status, message):
+    response = requests.Response()
+    response.status_code = status
+    response._content = json.dumps({"error": {"code": status, "message": message, "status": "INVALID_ARGUMENT"}}).encode()
+    return APIError(response)
+
+
+class Latency:
+    """每次呼叫的延遲 = base 秒 + 每千列 per_1000_rows 秒。"""
+
+    def __init__(self, base=0.05, per_1000_rows=0.002):
+        self.base = base
+        self.per_1000_rows = per_1000_rows
+        self.lock = threading.Lock()
+        self.calls = 0
+
+    def wait(self, rows=0):
+        with self.lock:
+            self.calls += 1
+        delay = self.base + self.per_1000_rows * rows / 1000
+        if delay > 0: time.sleep(delay)
+
+
+class FakeWorksheet:
+    def __init__(self, doc, title, sheet_id, rows=1000, cols=15):
+        self.doc = doc
+        self.title = title
+        self.id = sheet_id
+        self.row_count = rows
+        self.col_count = cols
+        self.rows = []
+
+    def _grow(self):
+        self.row_count = max(self.row_count, len(self.rows))
+
+    @staticmethod
+    def _cells(row):
+        return ["" if v is None else str(v) for v in row]
+
+    def get_all_values(self):
+        with self.doc.lock:
+            values = [list(r) for r in self.rows]
+        self.doc.latency.wait(len(values))
+        return values
+
+    def _range(self, spec):
+        if ":" in spec and spec.replace(":", "").isdigit():  # "5:5" 整列
+            lo, hi = (int(x) for x in spec.split(":"))
+        else:                                                 # "A5:J" 從第 5 列到最後
+            lo, hi = a1_to_rowcol(spec.split(":")[0])[0], len(self.rows)
+        if lo > self.row_count: raise _api_error(400, f"Range ({self.title}!{spec}) exceeds grid limits. Max rows: {self.row_count}")
+        return [list(r) for r in self.rows[lo - 1:hi]]
+
+    def batch_get(self, ranges):
+        with self.doc.lock:
+            out = [self._range(r) for r in ranges]
+        self.doc.latency.wait(sum(len(r) for r in out))
+        return out
+
+    def append_rows(self, rows):
+        self.doc.latency.wait(len(rows))
+        with self.doc.lock:
+            self.rows.extend(self._cells(r) for r in rows)
+            self._grow()
+
+    def append_row(self, row):
+        self.append_rows([row])
+
+    def batch_update(self, data):
+        self.doc.latency.wait(len(data))
+        with self.doc.lock:
+            for item in data:
+                r, c = a1_to_rowcol(item["range"])
+                while len(self.rows) < r: self.rows.append([])
+                row = self.rows[r - 1]
+                row.extend([""] * (c - len(row)))
+                row[c - 1] = str(item["values"][0][0])
+            self._grow()
+
+    def clear(self):
+        self.doc.latency.wait()
+        with self.doc.lock:
+            self.rows = []
+
+    def update(self, values, range_name="A1"):
+        self.doc.latency.wait(len(values))
+        with self.doc.lock:
+            self.rows = [self._cells(r) for r in values]
+            self._grow()
+
+
+class FakeSpreadsheet:
+    def __init__(self, title, latency):
+        self.title = title
+        self.latency = latency
+        self.lock = threading.RLock()
+        self._sheets = []
+
+    def worksheets(self):
+        self.latency.wait()
+        with self.lock:
+            return list(self._sheets)
+
+    @property
+    def sheet1(self):
+        return self._sheets[0]
+
+    def add_worksheet(self, title, rows=1000, cols=15):
+        self.latency.wait()
+        with self.lock:
+            ws = FakeWorksheet(self, title, len(self._sheets) + 1, int(rows), int(cols))
+            self._sheets.append(ws)
+            return ws
+
+    def values_batch_get(self, ranges):
+        """ranges 為 "'工作表名稱'" 形式的整張表範圍。"""
+        by_title = {ws.title: ws for ws in self._sheets}
+        with self.lock:
+            out = [{"range": r, "values": [list(row) for row in by_title[r.strip("'").replace("''", "'")].rows]} for r in ranges]
+        self.latency.wait(sum(len(v["values"]) for v in out))
+        return {"valueRanges": out}
+
+    def batch_update(self, body):
+        self.latency.wait(len(body.get("requests", [])))
+        by_id = {ws.id: ws for ws in self._sheets}
+        with self.lock:
+            for req in body.get("requests", []):
+                rng = req["deleteDimension"]["range"]
+                ws = by_id[rng["sheetId"]]
+                del ws.rows[rng["startIndex"]:rng["endIndex"]]
+                ws.row_count -= rng["endIndex"] - rng["startIndex"]   # 刪列會一併縮小格線
+
+    def load(self, title, values):
+        """直接放入資料 (不計延遲)，供建立測試資料用；格線剛好到資料結尾 (與一路 append 長大的工作表相同)。"""
+        ws = next((w for w in self._sheets if w.title == title), None)
+        if ws is None:
+            ws = FakeWorksheet(self, title, len(self._sheets) + 1, cols=max(15, len(values[0]) if values else 15))
+            self._sheets.append(ws)
+        ws.rows = [FakeWorksheet._cells(r) for r in values]
+        ws.row_count = len(ws.rows)
+        return ws
+
+
+class FakeClient:
+    def __init__(self, latency=None):
+        self.latency = latency or Latency()
+        self.docs = {}
+
+    def open(self, title):
+        self.latency.wait()
+        if title not in self.docs: self.docs[title] = FakeSpreadsheet(title, self.latency)
+        return self.docs[title]
@@ -0,0 +1,204 @@
+"""離線基準測試。
+
+    python -m bench.run                      # 執行並與 bench/baseline.json 比對
+    python -m bench.run --save-baseline      # 重新記錄基準
+    python -m bench.run --quick --latency 0  # 小資料、無延遲，快速檢查
+
+所有試算表呼叫都打到 bench/fake_gspread.py 的記憶體替身，延遲由 --latency 控制；
+比對基準時，中位數慢於基準 TOLERANCE 倍 (且差距超過 FLOOR 秒) 即視為退步，結束碼為 1。
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+import pandas as pd
+
+import data_store
+import reports
+from bench.fake_gspread import FakeClient, Latency
+from bench.synthetic import PERIODS, SyntheticSchool
+from indexes import RosterIndex
+from storage import DB_NAME, PATROL_SHEET, GSheetsBackend
+from write_queue import WriteQueue
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+TOLERANCE = 1.25
+FLOOR = 0.005
+
+
+def measure(fn, repeat, setup=None, latency=None):
+    """執行 repeat 次，回傳 {"median", "min", "api_calls"} (api_calls 為每次的平均呼叫數)。"""
+    times, calls = [], 0
+    for _ in range(repeat):
+        if setup: setup()
+        before = latency.calls if latency else 0
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+        calls += (latency.calls - before) if latency else 0
+    return {"median": round(statistics.median(times), 5), "min": round(min(times), 5), "api_calls": round(calls / repeat, 1)}
+
+
+def run(args):
+    scale = 0.1 if args.quick else 1.0
+    school = SyntheticSchool(students=int(3000 * scale), patrol_rows=int(200_000 * scale),
+                             leave_rows=int(5000 * scale), reward_rows=int(3000 * scale))
+    latency = Latency(base=args.latency, per_1000_rows=args.latency / 25)
+    client = FakeClient(latency)
+    school.load_into(client.open(DB_NAME))
+    workdir = tempfile.mkdtemp(prefix="bench-")
+    data_store.use_gspread_client(client, snapshot_dir="", write_spool_path=os.path.join(workdir, "spool.sqlite3"))
+    results = {}
+
+    def record(name, result):
+        results[name] = result
+        print(f"{name:<32} median {result['median'] * 1000:10.1f} ms   min {result['min'] * 1000:10.1f} ms   API {result['api_calls']:g}")
+
+    # 1. 原始二維串列 → 型別化 DataFrame
+    patrol_values = [data_store.LOG_HEADERS[PATROL_SHEET]] + [[str(v) for v in r] for r in school.patrol]
+    schema = data_store.LOG_SCHEMAS[PATROL_SHEET]
+    record("safe_get_dataframe", measure(lambda: data_store.safe_get_dataframe(patrol_values, schema), 5))
+
+    # 2. 靜態資料 (冷啟動 / 快取命中)
+    def clear_static():
+        data_store.use_gspread_client(client, snapshot_dir="", write_spool_path=os.path.join(workdir, "spool.sqlite3"))
+    record("load_static_data.cold", measure(data_store.load_static_data, 3, setup=clear_static, latency=latency))
+    record("load_static_data.warm", measure(data_store.load_static_data, 20, latency=latency))
+
+    # 學生名單 / 獎懲條文已有本機快照的冷啟動 (背景驗證與量測同時進行，只量時間不計 API 次數)
+    snapshot_dir = os.path.join(workdir, "snapshots")
+    def restart_with_snapshots():
+        for t in threading.enumerate():
+            if t.name == "revalidate-reference": t.join()
+        data_store.use_gspread_client(client, snapshot_dir=snapshot_dir, write_spool_path=os.path.join(workdir, "spool.sqlite3"))
+    restart_with_snapshots()
+    data_store.load_static_data()
+    record("load_static_data.snapshot", measure(data_store.load_static_data, 3, setup=restart_with_snapshots))
+    restart_with_snapshots()
+    clear_static()
+
+    # 3. 學生名單索引
+    roster = data_store.load_static_data().roster
+    df_students = roster.frame
+    record("roster_index.build", measure(lambda: RosterIndex(df_students), 10))
+    scan = [s[0] for s in school.students[:500]] + ["999999"] * 20
+    record("roster_index.lookup_many", measure(lambda: roster.lookup_many(scan), 50))
+
+    # 4. 紀錄表快取：整份載入 / 尾端同步
+    backend = GSheetsBackend(client, metrics=data_store.get_metrics())
+    def full_load():
+        data_store.LogCache(PATROL_SHEET, data_store.LOG_INDEXES[PATROL_SHEET], schema).get(backend)
+    record("log_cache.full_load", measure(full_load, 3, latency=latency))
+    cache = data_store.LogCache(PATROL_SHEET, data_store.LOG_INDEXES[PATROL_SHEET], schema)
+    cache.get(backend)
+    tail_rows = [[str(v) for v in r] for r in school.patrol[-50:]]
+    appended = []
+    def append_tail():
+        # 每次都再多 50 列新資料，量到的才是真的同步了 50 列
+        appended.extend(tail_rows)
+        client.open(DB_NAME).load(PATROL_SHEET, patrol_values + appended)
+        cache.invalidate()
+    def tail_sync():
+        cache.get(backend)
+        assert len(cache.frame) == len(patrol_values) - 1 + len(appended), "尾端同步沒有取回新增的列"
+    record("log_cache.tail_sync_50", measure(tail_sync, 5, setup=append_tail, latency=latency))
+    # 沒有新資料的定時重新同步 (格線剛好到資料結尾)：應只有一次小範圍讀取，不會整份重讀
+    record("log_cache.idle_sync", measure(tail_sync, 5, setup=cache.invalidate, latency=latency))
+    client.open(DB_NAME).load(PATROL_SHEET, patrol_values)
+
+    # 5. 每日呈核報表 (清除報表快取後重新產生)
+    day = school.dates[-1]
+    df_day = data_store.load_patrol_partition(day)
+    def daily_report():
+        reports._memo._items.clear()
+        reports.daily_patrol_report(data_store.as_text(df_day), day)
+    record("daily_report", measure(daily_report, 10))
+
+    # 6. 數據中心編輯後儲存 (200 列的一頁：改 10 格、刪 1 列、加 2 列)
+    def editor_case():
+        page = data_store.load_log_data(PATROL_SHEET).iloc[-200:]
+        edited = data_store.as_text(page)
+        for i in range(10): edited.iloc[i * 15, 7] = "秩序良好"
+        edited = edited.drop(edited.index[-1])
+        added = pd.DataFrame([edited.iloc[0].tolist()] * 2, columns=edited.columns, index=[-1, -2])
+        return page, pd.concat([edited, added])
+    page, edited = editor_case()
+    record("diff_log_edits", measure(lambda: data_store.diff_log_edits(page, edited), 20))
+    state = {}
+    def prepare_save():
+        client.open(DB_NAME).load(PATROL_SHEET, patrol_values)
+        data_store.invalidate_log_data(PATROL_SHEET, full=True)
+        state["page"], state["edited"] = editor_case()
+    record("save_log_edits", measure(lambda: data_store.save_log_edits(PATROL_SHEET, state["page"], state["edited"]), 3,
+                                     setup=prepare_save, latency=latency))
+    client.open(DB_NAME).load(PATROL_SHEET, patrol_values)
+
+    # 7. 多人同時送出暫存清單 (20 人 × 10 列)，量到全部寫入完成
+    def concurrent_submits():
+        queue = WriteQueue(backend, os.path.join(workdir, f"q{time.time_ns()}.sqlite3"), linger=0.05)
+        ids, lock = [], threading.Lock()
+        def submit(n):
+            rows = [[day, PERIODS[0], "班級", school.classes[n], "-", "-", "-", "秩序良好", 1, "bench"]] * 10
+            batch = queue.submit(PATROL_SHEET, rows)
+            with lock: ids.append(batch)
+        threads = [threading.Thread(target=submit, args=(n,)) for n in range(20)]
+        for t in threads: t.start()
+        for t in threads: t.join()
+        while any(queue.status(i)["state"] == "queued" for i in ids): time.sleep(0.005)
+    record("write_queue.20_submits", measure(concurrent_submits, 3, latency=latency))
+
+    meta = {"python": platform.python_version(), "pandas": pd.__version__, "latency": args.latency,
+            "quick": args.quick, "patrol_rows": len(school.patrol), "students": len(school.students)}
+    return meta, results
+
+
+def compare(meta, results, baseline):
+    if {k: baseline["meta"].get(k) for k in ("latency", "quick")} != {k: meta[k] for k in ("latency", "quick")}:
+        print("⚠️ 基準的延遲/資料量設定與本次不同，略過比對")
+        return True
+    ok = True
+    for name, r in results.items():
+        base = baseline["results"].get(name)
+        if base is None: continue
+        limit = max(base["median"] * TOLERANCE, base["median"] + FLOOR)
+        if r["median"] > limit:
+            ok = False
+            print(f"❌ {name} 退步：{r['median'] * 1000:.1f} ms (基準 {base['median'] * 1000:.1f} ms)")
+        if r["api_calls"] > base["api_calls"]:
+            ok = False
+            print(f"❌ {name} API 呼叫變多：{r['api_calls']:g} (基準 {base['api_calls']:g})")
+    if ok: print("✅ 與基準相比沒有退步")
+    return ok
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="離線基準測試")
+    parser.add_argument("--latency", type=float, default=0.05, help="每次模擬 API 呼叫的基本延遲 (秒)")
+    parser.add_argument("--quick", action="store_true", help="使用 1/10 資料量")
+    parser.add_argument("--save-baseline", action="store_true", help="把結果寫入 bench/baseline.json")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    args = parser.parse_args(argv)
+    logging.getLogger("streamlit").setLevel(logging.ERROR)
+
+    meta, results = run(args)
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump({"meta": meta, "results": results}, f, ensure_ascii=False, indent=2)
+        print(f"基準已寫入 {args.baseline}")
+        return 0
+    if not os.path.exists(args.baseline):
+        print("尚無基準，請先以 --save-baseline 記錄")
+        return 0
+    with open(args.baseline, encoding="utf-8") as f:
+        return 0 if compare(meta, results, json.load(f)) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,79 @@
+import ast
+import os
+import random
+from datetime import date, timedelta
+
+from accounts import hash_password
+from data_store import ACCOUNT_HEADERS, LOG_HEADERS, STUDENT_COLUMNS
+from storage import PATROL_SHEET
+
+APP_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app.py")
+
+
+def real_class_list():
+    """從 app.py 讀出 REAL_CLASS_LIST (不執行 Streamlit 腳本)。"""
+    with open(APP_PATH, encoding="utf-8") as f:
+        tree = ast.parse(f.read())
+    for node in ast.walk(tree):  # 腳本本體包在 try/finally 裡，不只看最上層
+        if isinstance(node, ast.Assign) and any(getattr(t, "id", None) == "REAL_CLASS_LIST" for t in node.targets):
+            return ast.literal_eval(node.value)
+    raise LookupError("app.py 中找不到 REAL_CLASS_LIST")
+
+
+CLASS_STATUSES = [("秩序良好", 1), ("午休良好", 1), ("導師入班", 1), ("上課吵鬧/秩序不佳", -1), ("午休吵鬧", -1), ("環境髒亂", -1), ("未節電", -1)]
+PERSONAL_STATUSES = [("服儀違規-書包/短裙/便服", 0), ("上課遊蕩/去合作社", -0.03), ("遲到/未到/曠課", -0.03), ("上課滑手機/睡覺", -0.03), ("熱心服務/表現優良", 0.03)]
+PERIODS = ["0810-0900 第一節", "0910-1000 第二節", "1010-1100 第三節", "1110-1200 第四節", "1230-1300 午休", "1310-1400 第五節", "1410-1500 第六節", "1510-1600 第七節"]
+REPORTERS = ["展宏主任", "生輔員甲", "生輔員乙", "教官丙", "行政丁"]
+
+
+# ==========================================
+# 合成的全校資料 (固定亂數種子，結果可重現)
+# ==========================================
+class SyntheticSchool:
+    def __init__(self, students=3000, patrol_rows=200_000, leave_rows=5000, reward_rows=3000,
+                 start=date(2026, 2, 1), days=180, seed=20260201):
+        rng = random.Random(seed)
+        self.classes = [c for cs in real_class_list().values() for c in cs]
+        self.dates = [(start + timedelta(days=i)).isoformat() for i in range(days)]
+
+        self.students = []
+        for i in range(students):
+            cls = self.classes[i % len(self.classes)]
+            seat = i // len(self.classes) + 1
+            self.students.append([str(110001 + i), f"學生{i:04d}", cls, f"{seat:02d}", f"09{rng.randint(10**7, 10**8 - 1)}", f"02{rng.randint(10**7, 10**8 - 1)}"])
+
+        # 巡查紀錄依日期排序，與實際逐日附加的順序一致
+        self.patrol = []
+        for d in self.dates:
+            for _ in range(patrol_rows // days):
+                if rng.random() < 0.6:
+                    status, score = rng.choice(CLASS_STATUSES)
+                    self.patrol.append([d, rng.choice(PERIODS), "班級", rng.choice(self.classes), "-", "-", "-", status, score, rng.choice(REPORTERS)])
+                else:
+                    sid, name, cls, seat = rng.choice(self.students)[:4]
+                    status, score = rng.choice(PERSONAL_STATUSES)
+                    self.patrol.append([d, rng.choice(PERIODS), "個人", cls, seat, sid, name, status, score, rng.choice(REPORTERS)])
+
+        self.leave = []
+        for _ in range(leave_rows):
+            sid, name, cls, seat = rng.choice(self.students)[:4]
+            d = rng.choice(self.dates)
+            self.leave.append([d, cls, seat, sid, name, rng.choice(["外散", "外宿"]), d, d, "18:00 返校", "親友家", "阿姨/0912345678", "生輔員甲"])
+
+        self.rewards = []
+        for _ in range(reward_rows):
+            sid, name, cls, seat = rng.choice(self.students)[:4]
+            kind = rng.choice(["獎勵", "懲處"])
+            self.rewards.append([rng.choice(self.dates), kind, sid, cls, f"{seat}-{name}", "嘉獎" if kind == "獎勵" else "警告", "合成事由", "1", "導師"])
+
+        self.accounts = [["admin", hash_password("1234", iterations=1000), "管理員", "展宏主任", "全校"]]
+        self.rules = [["嘉獎", "警告"], ["熱心服務", "遲到"], ["整潔優良", "服儀不整"]]
+
+    def load_into(self, doc):
+        """把全部資料放進 FakeSpreadsheet (巡查紀錄必須是第一個工作表)。"""
+        doc.load(PATROL_SHEET, [LOG_HEADERS[PATROL_SHEET]] + self.patrol)
+        doc.load("學生名單", [STUDENT_COLUMNS] + self.students)
+        doc.load("系統帳號密碼", [ACCOUNT_HEADERS] + self.accounts)
+        doc.load("獎懲條文", self.rules)
+        doc.load("僑生請假紀錄", [LOG_HEADERS["僑生請假紀錄"]] + self.leave)
+        doc.load("獎懲紀錄總表", [LOG_HEADERS["獎懲紀錄總表"]] + self.rewards)
@@ -0,0 +1,768 @@
+import json
+import logging
+import re
+import threading
+import time
+from collections import Counter, namedtuple
+from types import MappingProxyType
+
+import gspread
+import numpy as np
+import pandas as pd
+import streamlit as st
+from pandas.api.types import union_categoricals
+from google.oauth2.service_account import Credentials
+
+from accounts import AccountStore, hash_password, is_hashed
+from indexes import DateIndex, LeaveIntervals, RosterIndex, ScoreAggregates, StudentIndex
+from metrics import Metrics
+from snapshots import SnapshotStore
+from storage import PATROL_SHEET, GSheetsBackend, SheetNotFound, SQLiteBackend
+from write_queue import WriteQueue
+
+logger = logging.getLogger(__name__)
+
+# ==========================================
+# 各紀錄表的標準欄位 (新建工作表時寫入標題列)
+# ==========================================
+LOG_HEADERS = {
+    PATROL_SHEET: ["日期", "時間", "對象", "班級", "座號", "學號", "姓名", "狀況", "得分", "回報人"],
+    "僑生請假紀錄": ["紀錄日期", "班級", "座號", "學號", "姓名", "類別", "起點日期", "迄止日期", "細節與時間", "外宿地點", "親友/關係/電話", "經辦人"],
+    "獎懲紀錄總表": ["日期", "類別", "學號", "班級", "座號姓名", "獎懲項目", "事由", "建議次數", "導師簽名"],
+}
+PATROL_ARCHIVE_PREFIX = "巡查紀錄封存_"  # 已結束月份的巡查紀錄封存表：巡查紀錄封存_YYYY-MM
+ACCOUNT_HEADERS = ["帳號", "密碼", "職務", "姓名", "負責班級"]
+STUDENT_COLUMNS = ['學號', '姓名', '班級', '座號', '學生手機', '家長聯絡電話']
+
+# 各紀錄表的欄位型別：低基數的文字欄存成 category，其餘維持文字。
+# 得分也存成 category 而不是 float，保留試算表上的原字串 (1.50、+1、手動填的文字)，封存與編輯寫回才不會失真；
+# 需要計算時 (排行榜、個人歷程) 才以 pd.to_numeric 轉成數字。
+# 日期欄刻意保留原字串 (category)，分區索引、封存月份與寫回試算表都以 YYYY-MM-DD 文字為準。
+LOG_SCHEMAS = {
+    PATROL_SHEET: {"日期": "category", "時間": "category", "對象": "category", "班級": "category",
+                   "狀況": "category", "得分": "category", "回報人": "category"},
+    "僑生請假紀錄": {"紀錄日期": "category", "班級": "category", "類別": "category", "經辦人": "category"},
+    "獎懲紀錄總表": {"日期": "category", "類別": "category", "班級": "category", "獎懲項目": "category", "導師簽名": "category"},
+}
+
+# ==========================================
+# 安全讀取引擎
+# ==========================================
+def safe_get_dataframe(data, schema=None):
+    """把 get_all_values() 形式的二維串列轉成 DataFrame (自動補齊空白/重複標題)，可依 schema 轉換欄位型別。"""
+    if not data: return pd.DataFrame()
+    clean_headers, seen, repeats = [], set(), {}
+    for i, h in enumerate(data[0]):
+        base = str(h).strip() or f"未命名欄位_{i}"
+        n = repeats.get(base, 0)
+        val = base + "_重複" * n
+        while val in seen:
+            n += 1
+            val = base + "_重複" * n
+        repeats[base] = n + 1
+        seen.add(val)
+        clean_headers.append(val)
+    if len(data) > 1: return apply_schema(pd.DataFrame(data[1:], columns=clean_headers), schema)
+    return pd.DataFrame(columns=clean_headers)
+
+def apply_schema(df, schema):
+    """依欄位型別表轉換欄位 (目前只有 category)，表中沒有的欄位略過。"""
+    if df.empty or not schema: return df
+    converted = {col: df[col].astype("category") for col in schema if col in df.columns}
+    return df.assign(**converted) if converted else df
+
+def concat_typed(frames):
+    """串接同欄位的表格；category 欄取類別聯集，不會退化成 object。"""
+    frames = [f for f in frames if not f.empty]
+    if not frames: return pd.DataFrame()
+    if len(frames) == 1: return frames[0].reset_index(drop=True)
+    columns = {}
+    for c in frames[0].columns:
+        parts = [f[c] for f in frames]
+        if all(isinstance(p.dtype, pd.CategoricalDtype) for p in parts):
+            columns[c] = pd.Series(union_categoricals(parts, ignore_order=True))
+        else:
+            columns[c] = pd.concat(parts, ignore_index=True)
+    return pd.DataFrame(columns)
+
+def as_text(frame):
+    """把型別化的表格轉回試算表上的原文字 (空值為空字串)，供編輯與寫回使用。"""
+    columns = {c: frame[c].astype(object).where(frame[c].notna(), "").astype(str) for c in frame.columns}
+    return pd.DataFrame(columns, index=frame.index, columns=frame.columns)
+
+# ==========================================
+# 儲存後端選擇 (由 secrets 的 [storage] 區段設定)
+#   backend = "gspread" (預設) 或 "sqlite"
+#   sqlite_path = "school_db.sqlite3"
+#   mirror_to_sheets = true  → SQLite 寫入後同步鏡像到 Google 試算表
+#   import_from_sheets = true  → 本機資料庫還沒有巡查紀錄表時，先從 Google 試算表整份匯入 (初次切換用)
+#   write_spool_path = "write_spool.sqlite3"  → 背景寫入佇列的本機暫存檔
+#   snapshot_dir = ".snapshots"  → 本機快照目錄 (設為空字串停用)，冷啟動時先用快照供應資料
+# ==========================================
+_overrides = {}  # 離線執行 (基準測試) 時替換的 gspread client 與儲存設定
+
+def use_gspread_client(client, **config):
+    """改用指定的 gspread 相容 client (例如 bench/fake_gspread.py)，config 覆蓋 [storage] 設定；會清除所有快取。"""
+    _overrides.update(client=client, config=config)
+    st.cache_resource.clear()
+    st.cache_data.clear()
+
+def _storage_config():
+    try:
+        cfg = dict(st.secrets.get("storage", {}))
+    except FileNotFoundError:
+        cfg = {}
+    cfg.update(_overrides.get("config", {}))
+    return cfg
+
+@st.cache_resource
+def init_gspread():
+    if "client" in _overrides: return _overrides["client"]
+    creds_json = json.loads(st.secrets["google_json"])
+    scopes = ["https://www.googleapis.com/auth/spreadsheets", "https://www.googleapis.com/auth/drive"]
+    creds = Credentials.from_service_account_info(creds_json, scopes=scopes)
+    return gspread.authorize(creds)
+
+@st.cache_resource
+def get_metrics():
+    return Metrics()
+
+def record_rerun(seconds):
+    get_metrics().record_rerun(seconds)
+
+@st.cache_resource
+def get_backend():
+    cfg = _storage_config()
+    if cfg.get("backend", "gspread") == "sqlite":
+        mirror = GSheetsBackend(init_gspread(), metrics=get_metrics()) if cfg.get("mirror_to_sheets") else None
+        backend = SQLiteBackend(cfg.get("sqlite_path", "school_db.sqlite3"), mirror=mirror)
+        if cfg.get("import_from_sheets") and not backend.has_sheet(PATROL_SHEET):
+            logger.info("本機資料庫尚無資料，從 Google 試算表匯入")
+            backend.import_from(mirror or GSheetsBackend(init_gspread(), metrics=get_metrics()))
+        return backend
+    return GSheetsBackend(init_gspread(), metrics=get_metrics())
+
+@st.cache_resource
+def get_snapshot_store():
+    directory = _storage_config().get("snapshot_dir", ".snapshots")
+    if not directory or not SnapshotStore.available(): return None
+    try:
+        return SnapshotStore(directory)
+    except OSError:
+        logger.warning("無法建立快照目錄 %s，停用本機快照", directory, exc_info=True)
+        return None
+
+# ==========================================
+# 快取版本號 (每張工作表各自一個計數器)
+#   要失效某張表只需把它的版本 +1 (學生名單與獎懲條文以兩張表版本號的組合當作快取鍵)，
+#   衍生快取 (例如封存月份清單) 也以版本號當鍵；紀錄表的版本由各自的 LogCache 維護。
+# ==========================================
+STATIC_SHEETS = ["學生名單", "系統帳號密碼", "獎懲條文"]
+
+class CacheVersions:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.versions = {}
+
+    def get(self, name):
+        return self.versions.get(name, 0)
+
+    def bump(self, name):
+        with self.lock:
+            self.versions[name] = self.versions.get(name, 0) + 1
+
+@st.cache_resource
+def _cache_versions():
+    return CacheVersions()
+
+# ==========================================
+# 1. 靜態資料快取
+#   學生名單與獎懲條文以一次 values_batch_get 讀回 (工作表是否存在由快取的中繼資料判斷)，
+#   解析後的名單索引、條文與「類別 → 條文」對照一起放在 cache_resource，唯讀共用；
+#   快取鍵是兩張表版本號的組合。兩張表另存本機快照：行程啟動後第一次讀取直接供應快照，
+#   背景再向後端確認，內容有變才把版本 +1，下一次重跑就換成新資料。
+#   帳號表含密碼，不寫入快照；登入或管理帳號時才讀取 (load_accounts)。
+# ==========================================
+STUDENT_FALLBACK_SHEET = "基本資料庫"  # 舊版試算表的學生名單工作表
+REFERENCE_SHEETS = ["學生名單", "獎懲條文"]
+
+StaticData = namedtuple("StaticData", ["roster", "rules", "rules_by_category"])
+
+def _prepare_students(values):
+    try:
+        df_stu = safe_get_dataframe(values)
+        df_stu.columns = df_stu.columns.str.strip()
+        rename_map = {"班級名稱": "班級", "手機號碼": "學生手機", "家長電話": "家長聯絡電話"}
+        df_stu.rename(columns=rename_map, inplace=True)
+
+        for col in STUDENT_COLUMNS:
+            if col not in df_stu.columns: df_stu[col] = ""
+        df_stu['學號'] = df_stu['學號'].astype(str).str.strip()
+        df_stu['座號'] = df_stu['座號'].astype(str).str.zfill(2)
+    except Exception:
+        df_stu = pd.DataFrame(columns=STUDENT_COLUMNS)
+    return df_stu
+
+# 帳號表只以 AccountStore 形式快取，明文密碼不會留在快取的 DataFrame 裡
+def _prepare_accounts(backend, values):
+    if values is not None: return AccountStore(safe_get_dataframe(values))
+    default_admin = ["admin", hash_password("1234"), "管理員", "展宏主任", "全校"]
+    backend.create_sheet("系統帳號密碼", ACCOUNT_HEADERS, rows=100)
+    backend.append_rows("系統帳號密碼", [default_admin])
+    return AccountStore(pd.DataFrame([default_admin], columns=ACCOUNT_HEADERS))
+
+def _prepare_rules(frame):
+    by_category = {col: tuple(r for r in frame[col].dropna().tolist() if str(r).strip() != "") for col in frame.columns}
+    return MappingProxyType(by_category)
+
+def _fetch_reference(backend):
+    """一次請求讀回學生名單 (或舊版的基本資料庫) 與獎懲條文，回傳 {表名: 整理後的 DataFrame}。"""
+    names = list(REFERENCE_SHEETS)
+    if not backend.has_sheet("學生名單"): names.append(STUDENT_FALLBACK_SHEET)
+    values = backend.get_many(names)
+    return {"學生名單": _prepare_students(values.get("學生名單") or values.get(STUDENT_FALLBACK_SHEET) or []),
+            "獎懲條文": safe_get_dataframe(values["獎懲條文"] or [])}
+
+class ReferenceSnapshots:
+    def __init__(self, store):
+        self.store = store
+        self.lock = threading.Lock()
+        self.validated = False   # 本行程是否已向後端確認過
+        self.fresh = None        # 背景驗證取回、尚未被載入函式取用的最新內容
+
+    def frames(self, backend, versions):
+        """回傳 {表名: DataFrame}；回傳的表格請勿原地修改。"""
+        with self.lock:
+            if self.fresh is not None:
+                fresh, self.fresh = self.fresh, None
+                return fresh
+            first, self.validated = not self.validated, True
+        stale = self._load() if first and self.store else None
+        if stale is None:
+            frames = _fetch_reference(backend)
+            self._save(frames)
+            return frames
+        def revalidate():
+            try:
+                latest = _fetch_reference(backend)
+            except Exception:
+                logger.warning("背景重新驗證學生名單 / 獎懲條文失敗，繼續使用快照", exc_info=True)
+                with self.lock: self.validated = False
+                return
+            self._save(latest)
+            changed = [n for n in REFERENCE_SHEETS if not as_text(latest[n]).equals(as_text(stale[n]))]
+            if changed:
+                with self.lock: self.fresh = latest
+                for name in changed: versions.bump(name)
+        threading.Thread(target=revalidate, name="revalidate-reference", daemon=True).start()
+        return stale
+
+    def _load(self):
+        snaps = {name: self.store.load(name) for name in REFERENCE_SHEETS}
+        if any(snap is None for snap in snaps.values()): return None
+        return {name: snap[0] for name, snap in snaps.items()}
+
+    def _save(self, frames):
+        if self.store:
+            for name, frame in frames.items(): self.store.save(name, frame)
+
+@st.cache_resource
+def _reference_snapshots():
+    return ReferenceSnapshots(get_snapshot_store())
+
+@st.cache_resource(ttl=600)
+def _load_static(versions_key):
+    get_metrics().record_cache("靜態資料", "miss")
+    frames = _reference_snapshots().frames(get_backend(), _cache_versions())
+    df_rules = frames["獎懲條文"]
+    return StaticData(RosterIndex(frames["學生名單"]), df_rules, _prepare_rules(df_rules))
+
+@st.cache_resource(ttl=600)
+def _load_accounts(version):
+    get_metrics().record_cache("系統帳號密碼", "miss")
+    backend = get_backend()
+    return _prepare_accounts(backend, backend.get_many(["系統帳號密碼"])["系統帳號密碼"])
+
+def migrate_account_passwords():
+    """一次性把帳號表中的明文密碼全部換成加鹽雜湊 (只批次更新需要轉換的儲存格)。"""
+    backend = get_backend()
+    data = backend.get_values("系統帳號密碼")
+    headers = [str(h).strip() for h in data[0]] if data else []
+    if "密碼" not in headers: return 0
+    col = headers.index("密碼")
+    cells = [(i + 2, col + 1, hash_password(str(row[col]).strip())) for i, row in enumerate(data[1:])
+             if len(row) > col and str(row[col]).strip() and not is_hashed(str(row[col]).strip())]
+    backend.update_cells("系統帳號密碼", cells)
+    _cache_versions().bump("系統帳號密碼")
+    return len(cells)
+
+def load_static_data():
+    """回傳 StaticData(roster 學生名單索引, rules 獎懲條文, rules_by_category 類別 → 條文)。"""
+    versions = _cache_versions()
+    return _cached("靜態資料", _load_static, tuple(versions.get(n) for n in REFERENCE_SHEETS))
+
+def load_accounts():
+    """回傳帳號庫 AccountStore (登入與管理帳號時才呼叫)。"""
+    return _cached("系統帳號密碼", _load_accounts, _cache_versions().get("系統帳號密碼"))
+
+def _cached(name, loader, key):
+    """呼叫靜態資料的快取函式；函式本體沒有執行 (沒記到未命中) 就算命中。"""
+    metrics = get_metrics()
+    misses = metrics.cache_count(name, "miss")
+    value = loader(key)
+    if metrics.cache_count(name, "miss") == misses: metrics.record_cache(name, "hit")
+    return value
+
+# ==========================================
+# 2. 動態紀錄資料快取 (增量尾端同步)
+#   每張紀錄表在行程內只保留一份 DataFrame 與已同步列數，
+#   過期後只讀取新增的列；標題列或上次最後一列對不上 (有列被刪改) 才整份重讀。
+#   內容變動後在背景存一份本機快照 (SNAPSHOT_DELAY 秒內的多次變動只寫最後一份)；
+#   行程重啟時先從快照供應，背景再做尾端同步。
+# ==========================================
+LOG_TTL = 60
+SNAPSHOT_DELAY = 5
+
+def _trim(row):
+    row = ["" if v is None else str(v) for v in (row or [])]
+    while row and row[-1] == "": row.pop()
+    return row
+
+class LogCache:
+    def __init__(self, sheet_name, index_types=None, schema=None, snapshots=None, metrics=None):
+        self.sheet_name = sheet_name
+        self.metrics = metrics
+        self.schema = schema or {}              # {欄名: "category"}
+        self.snapshots = snapshots              # SnapshotStore 或 None
+        self.stale = None                       # 從快照還原、背景驗證完成前供應的 (表格, 索引)
+        self.restore_tried = False
+        self.index_types = index_types or {}   # {名稱: 具 build/extend 的索引類別}
+        self.indexes = {}
+        self.lock = threading.Lock()
+        self.save_lock = threading.Lock()
+        self.pending_save = None  # 等待背景寫入的 (表格, 同步資訊)
+        self.saving = False
+        self.frame = pd.DataFrame()
+        self.header = None        # 上次同步的標題列 (None 代表尚未成功讀取)
+        self.anchor = []          # 上次同步的最後一列，用來偵測刪改
+        self.synced_rows = 0      # 已同步的資料列數 (不含標題列)
+        self.synced_at = 0.0
+        self.needs_full = True
+        self.version = 0          # 內容每變動一次就 +1，供衍生快取當作鍵
+
+    def _full_reload(self, backend):
+        try:
+            data = backend.get_values(self.sheet_name)
+        except SheetNotFound:
+            data = []
+        self.frame = safe_get_dataframe(data, self.schema)
+        self.header = _trim(data[0]) if data else None
+        self.anchor = _trim(data[-1]) if data else []
+        self.synced_rows = max(len(data) - 1, 0)
+        self.needs_full = self.header is None
+        self.indexes = {k: t.build(self.frame) for k, t in self.index_types.items()}
+        self.version += 1
+
+    def _tail_sync(self, backend):
+        try:
+            tail = backend.get_tail(self.sheet_name, self.synced_rows + 2)
+        except SheetNotFound:
+            return self._full_reload(backend)
+        if tail is None: return self._full_reload(backend)
+        header, anchor, rows = tail
+        if _trim(header) != self.header or _trim(anchor) != self.anchor: return self._full_reload(backend)
+        if not rows: return
+        width = len(self.frame.columns)
+        if any(len(_trim(r)) > width for r in rows): return self._full_reload(backend)
+        rows = [list(r)[:width] + [""] * (width - len(r)) for r in rows]
+        start = len(self.frame)
+        self.frame = concat_typed([self.frame, apply_schema(pd.DataFrame(rows, columns=self.frame.columns), self.schema)])
+        self.indexes = {k: idx.extend(self.frame, start) for k, idx in self.indexes.items()}
+        self.anchor = _trim(rows[-1])
+        self.synced_rows += len(rows)
+        self.version += 1
+
+    def _restore_snapshot(self, backend):
+        """行程啟動後第一次讀取：有快照就先還原並在背景做尾端同步，回傳是否已還原。"""
+        self.restore_tried = True
+        snap = self.snapshots.load(self.sheet_name) if self.snapshots else None
+        if snap is None or snap[1].get("header") is None: return False
+        if any(c in snap[0].columns and not isinstance(snap[0][c].dtype, pd.CategoricalDtype) for c in self.schema):
+            # 舊版程式存的快照 (欄位型別與目前的 schema 不同)，丟棄後改為整份重讀
+            self.snapshots.discard(self.sheet_name)
+            return False
+        self.frame, meta = snap
+        self.header, self.anchor = meta["header"], meta.get("anchor", [])
+        self.synced_rows = meta.get("synced_rows", len(self.frame))
+        self.needs_full = False
+        self.indexes = {k: t.build(self.frame) for k, t in self.index_types.items()}
+        self.version += 1
+        self.stale = (self.frame, self.indexes)
+        threading.Thread(target=self._revalidate, args=(backend,), name=f"revalidate-{self.sheet_name}", daemon=True).start()
+        return True
+
+    def _revalidate(self, backend):
+        try:
+            with self.lock: self._refresh(backend, 0)
+        except Exception:
+            logger.warning("背景重新驗證 %s 失敗", self.sheet_name, exc_info=True)
+        finally:
+            self.stale = None
+
+    def _save_snapshot(self):
+        """排入背景寫入；表格每次變動都是新物件，不必複製。"""
+        if not self.snapshots or self.header is None: return
+        with self.save_lock:
+            self.pending_save = (self.frame, {"header": self.header, "anchor": self.anchor, "synced_rows": self.synced_rows})
+            if self.saving: return
+            self.saving = True
+        threading.Thread(target=self._write_snapshots, name=f"snapshot-{self.sheet_name}", daemon=True).start()
+
+    def _write_snapshots(self):
+        while True:
+            time.sleep(SNAPSHOT_DELAY)
+            with self.save_lock:
+                job, self.pending_save = self.pending_save, None
+                if job is None:
+                    self.saving = False
+                    return
+            self.snapshots.save(self.sheet_name, *job)
+
+    def _refresh(self, backend, ttl):
+        """必要時與後端同步；回傳這次是否有呼叫後端 (快取未命中)。"""
+        if not self.restore_tried and self.needs_full and self._restore_snapshot(backend): return False
+        if not self.needs_full and time.time() - self.synced_at < ttl: return False
+        version = self.version
+        if self.needs_full: self._full_reload(backend)
+        else: self._tail_sync(backend)
+        self.synced_at = time.time()
+        if self.version != version: self._save_snapshot()
+        return True
+
+    def _record(self, missed):
+        if self.metrics: self.metrics.record_cache(self.sheet_name, "miss" if missed else "hit")
+
+    def get(self, backend, ttl=LOG_TTL, fresh=False):
+        """fresh=True 時不供應快照內容 (要依列號改寫工作表的呼叫端用)，必要時等背景驗證完成。"""
+        stale = None if fresh else self.stale
+        if stale is not None:   # 背景驗證中，先供應快照內容不必等待
+            self._record(False)
+            return stale[0]
+        with self.lock:
+            self._record(self._refresh(backend, ttl))
+            return self.frame
+
+    def get_with_index(self, backend, name, ttl=LOG_TTL, fresh=False):
+        """同時取回表格與對應版本的索引，確保兩者一致。"""
+        stale = None if fresh else self.stale
+        if stale is not None:
+            self._record(False)
+            return stale[0], stale[1][name]
+        with self.lock:
+            self._record(self._refresh(backend, ttl))
+            return self.frame, self.indexes[name]
+
+    def invalidate(self, full=False):
+        with self.lock:
+            self.synced_at = 0.0
+            if full:
+                # 不再供應 (也不再還原) 快照，下次讀取一定整份重讀
+                self.needs_full, self.restore_tried, self.stale = True, True, None
+
+# 各紀錄表同步時要一併維護的索引
+LOG_INDEXES = {
+    PATROL_SHEET: {"date": DateIndex, "scores": ScoreAggregates, "student": StudentIndex},
+    "僑生請假紀錄": {"intervals": LeaveIntervals, "student": StudentIndex},
+    "獎懲紀錄總表": {"student": StudentIndex},
+}
+
+@st.cache_resource
+def _log_cache(sheet_name):
+    base = PATROL_SHEET if sheet_name.startswith(PATROL_ARCHIVE_PREFIX) else sheet_name
+    return LogCache(sheet_name, LOG_INDEXES.get(base), LOG_SCHEMAS.get(base), get_snapshot_store(), get_metrics())
+
+def load_log_data(sheet_name, fresh=False):
+    """回傳紀錄表的 DataFrame (各使用者共用同一份，請勿原地修改)。"""
+    try:
+        return _log_cache(sheet_name).get(get_backend(), fresh=fresh)
+    except Exception: return pd.DataFrame()
+
+def invalidate_log_data(sheet_name, full=False):
+    _log_cache(sheet_name).invalidate(full=full)
+
+def log_memory_report():
+    """各紀錄表快取的記憶體用量：型別化後 vs 全部存成文字 (MB)。"""
+    rows = []
+    for name in LOG_HEADERS:
+        frame = load_log_data(name)
+        typed = frame.memory_usage(deep=True).sum()
+        text = as_text(frame).astype(object).memory_usage(deep=True).sum()
+        rows.append({"工作表": name, "列數": len(frame), "型別化 (MB)": round(typed / 2**20, 2),
+                     "純文字 (MB)": round(text / 2**20, 2), "倍數": round(text / typed, 1) if typed else 0.0})
+    return pd.DataFrame(rows)
+
+def refresh_sheets(sheet_names):
+    """管理員手動重新同步：只讓指定的工作表失效，下次讀取時整份重讀。"""
+    for name in sheet_names:
+        if name in LOG_HEADERS: invalidate_log_data(name, full=True)
+        else: _cache_versions().bump(name)
+
+# ==========================================
+# 紀錄表的伺服器端篩選 (數據中心分頁瀏覽用)
+#   篩選結果保留原本的 index (= 資料列位置)，編輯後仍可用 save_log_edits 對回工作表的列。
+# ==========================================
+LOG_FILTER_FIELDS = {
+    PATROL_SHEET: {"date": "日期", "class": "班級", "student": "學號", "reporter": "回報人", "status": "狀況"},
+    "僑生請假紀錄": {"date": "紀錄日期", "class": "班級", "student": "學號", "reporter": "經辦人", "status": "類別"},
+    "獎懲紀錄總表": {"date": "日期", "class": "班級", "student": "學號", "reporter": "導師簽名", "status": "獎懲項目"},
+}
+
+def query_log(sheet_name, date_from=None, date_to=None, class_name=None, student_id=None, reporter=None, status=None):
+    """在快取的紀錄表上做向量化篩選；日期為 YYYY-MM-DD 字串，reporter/status 為部分比對。
+
+    結果會交給 save_log_edits 換算列號，所以不使用快照內容。
+    """
+    df = load_log_data(sheet_name, fresh=True)
+    if df.empty: return df
+    fields = LOG_FILTER_FIELDS.get(sheet_name, {})
+    mask = np.ones(len(df), dtype=bool)
+    def column(key):
+        name = fields.get(key)
+        return df[name] if name in df.columns else None
+    def where(series, pred):
+        # category 欄只對類別 (通常數十到數百個) 求值，再用 isin 展開到各列，不必把整欄轉成字串
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            cats = series.cat.categories.astype(str)
+            return series.isin(series.cat.categories[np.asarray(pred(cats), dtype=bool)]).to_numpy()
+        return np.asarray(pred(series.astype(str)), dtype=bool)
+    dates, classes, students = column("date"), column("class"), column("student")
+    reporters, statuses = column("reporter"), column("status")
+    if (date_from or date_to) and dates is not None:
+        mask &= where(dates, lambda v: ((v >= date_from) if date_from else True) & ((v <= date_to) if date_to else True))
+    if class_name and classes is not None: mask &= (classes == class_name).to_numpy()
+    if student_id and students is not None: mask &= where(students, lambda v: v.str.strip() == student_id.strip())
+    if reporter and reporters is not None: mask &= where(reporters, lambda v: v.str.contains(reporter, regex=False))
+    if status and statuses is not None: mask &= where(statuses, lambda v: v.str.contains(status, regex=False))
+    return df if mask.all() else df[mask]
+
+# ==========================================
+# 僑生請假的區間查詢 (晚間點名、重複請假檢查)
+# ==========================================
+def leaves_on(date, classes=None):
+    """date 當天請假在外的紀錄 (依班級、座號排序)；classes 可限定班級。"""
+    try:
+        frame, index = _log_cache("僑生請假紀錄").get_with_index(get_backend(), "intervals")
+    except Exception: return pd.DataFrame()
+    df = frame.iloc[index.positions_on(date)]
+    if classes is not None and not df.empty: df = df[df["班級"].astype(str).isin(list(classes))]
+    return df.sort_values(["班級", "座號"], kind="stable") if not df.empty else df
+
+def leave_conflicts(student_id, start_date, end_date):
+    """同一學號中與 start_date ~ end_date 重疊的既有假單。"""
+    try:
+        frame, index = _log_cache("僑生請假紀錄").get_with_index(get_backend(), "intervals")
+    except Exception: return pd.DataFrame()
+    return frame.iloc[index.overlapping(student_id, start_date, end_date)]
+
+# ==========================================
+# 批次列印表單 (依日期範圍，每班一份)
+#   把紀錄表的列還原成 reports.leave_form / reward_form 使用的清單格式。
+# ==========================================
+_RETURN_TIME = re.compile(r"^返校:(\S*) / ?(.*)$", re.S)
+
+def leave_form_batches(date_from, date_to):
+    """紀錄日期在範圍內的請假紀錄，回傳 [(班級, 假單清單)]，依班級排序。"""
+    df = as_text(query_log("僑生請假紀錄", date_from, date_to))
+    if df.empty: return []
+    roster = load_static_data().roster.frame
+    phones = roster.drop_duplicates("學號").set_index("學號")[["學生手機", "家長聯絡電話"]] if not roster.empty else None
+    parsed = df["細節與時間"].str.extract(_RETURN_TIME)
+    stay = df["類別"] == "外宿"
+    out = pd.DataFrame({
+        "班級": df["班級"], "座號": df["座號"], "學號": df["學號"], "姓名": df["姓名"],
+        "學生手機": df["學號"].map(phones["學生手機"]).fillna("") if phones is not None else "",
+        "家長電話": df["學號"].map(phones["家長聯絡電話"]).fillna("") if phones is not None else "",
+        "類別": df["類別"], "起訖日期": df["起點日期"] + " ~ " + df["迄止日期"],
+        "返校時間": parsed[0].fillna("").where(~stay, "21:00點名"),
+        "事由與細節": parsed[1].fillna(df["細節與時間"]) + (" | " + df["外宿地點"]).where(stay, ""),
+        "親友資訊": df["親友/關係/電話"].where(stay, "-"),
+    })
+    out = out.sort_values(["班級", "座號"], kind="stable")
+    return [(c, g.to_dict("records")) for c, g in out.groupby("班級", sort=True)]
+
+def reward_form_batches(date_from, date_to):
+    """日期在範圍內的獎懲紀錄，回傳 [(班級, 類別, 建議清單)]；獎勵與懲處分開成不同的建議單。"""
+    df = as_text(query_log("獎懲紀錄總表", date_from, date_to))
+    if df.empty: return []
+    df = df.sort_values(["班級", "類別", "座號姓名"], kind="stable")
+    return [(c, t, g.to_dict("records")) for (c, t), g in df.groupby(["班級", "類別"], sort=True)]
+
+# ==========================================
+# 巡查紀錄的日期分區
+#   已結束的月份可封存到「巡查紀錄封存_YYYY-MM」工作表，主表只留當月資料；
+#   日期範圍查詢透過日期索引只取出需要的分區，不再整表比對日期。
+# ==========================================
+ARCHIVE_TTL = 3600  # 封存表不再變動，可以放很久
+
+@st.cache_data(ttl=600)
+def _patrol_archive_months(version):
+    names = get_backend().list_sheets()
+    return sorted(n[len(PATROL_ARCHIVE_PREFIX):] for n in set(names) if n.startswith(PATROL_ARCHIVE_PREFIX))
+
+def patrol_archive_months():
+    return _patrol_archive_months(_cache_versions().get(PATROL_ARCHIVE_PREFIX))
+
+def _patrol_indexes(start_date, end_date, index_name):
+    """逐一取出涵蓋日期範圍的分區 (封存月份 + 主表) 及其索引。"""
+    backend = get_backend()
+    sources = [(PATROL_ARCHIVE_PREFIX + m, ARCHIVE_TTL) for m in patrol_archive_months() if start_date[:7] <= m <= end_date[:7]]
+    sources.append((PATROL_SHEET, LOG_TTL))
+    for name, ttl in sources:
+        try:
+            yield _log_cache(name).get_with_index(backend, index_name, ttl=ttl)
+        except Exception: continue
+
+def load_patrol_partition(start_date, end_date=None):
+    """取出 start_date ~ end_date (含，YYYY-MM-DD) 的巡查紀錄，只讀取涵蓋到的分區。"""
+    end_date = end_date or start_date
+    parts = []
+    for frame, index in _patrol_indexes(start_date, end_date, "date"):
+        if not frame.empty: parts.append(frame.take(index.positions(start_date, end_date)))
+    return concat_typed(parts)
+
+_MONTH_RE = re.compile(r"^\d{4}-\d{2}")
+
+def _closed_month_positions(index, today):
+    by_month = {}
+    for d in index.dates:
+        if _MONTH_RE.match(d) and d[:7] < today[:7]:
+            by_month.setdefault(d[:7], []).append(index.positions(d))
+    return {m: np.sort(np.concatenate(parts)) for m, parts in sorted(by_month.items())}
+
+def load_score_aggregates(start_date, end_date):
+    """合併涵蓋日期範圍各分區的班級得分彙總 (ScoreAggregates)，不需重掃原始紀錄。"""
+    merged = None
+    for _, scores in _patrol_indexes(start_date, end_date, "scores"):
+        merged = scores if merged is None else merged.merge(scores)
+    return merged if merged is not None else ScoreAggregates.build(pd.DataFrame())
+
+def closed_month_rows(today):
+    """主表中屬於已結束月份、可以封存的列數。"""
+    _, index = _log_cache(PATROL_SHEET).get_with_index(get_backend(), "date")
+    return sum(len(p) for p in _closed_month_positions(index, today).values())
+
+def archive_closed_months(today):
+    """把主表中已結束月份的巡查紀錄搬到各月封存表，再一次從主表刪除。回傳 {月份: 列數}。
+
+    封存表裡已經有的列不會再附加 (上次附加成功但刪除主表失敗，或重複按下封存時)。
+    """
+    backend = get_backend()
+    cache = _log_cache(PATROL_SHEET)
+    cache.invalidate(full=True)  # 以最新的整份內容決定列號，避免刪錯列
+    frame, index = cache.get_with_index(backend, "date")
+    moved, doomed = {}, []
+    for month, positions in _closed_month_positions(index, today).items():
+        name = PATROL_ARCHIVE_PREFIX + month
+        try:
+            archived = Counter(tuple(_trim(r)) for r in backend.get_values(name)[1:])
+        except SheetNotFound:
+            archived = Counter()
+        fresh = []
+        for row in as_text(frame.take(positions)).values.tolist():
+            key = tuple(_trim(row))
+            if archived[key]: archived[key] -= 1
+            else: fresh.append(row)
+        backend.ensure_sheet(name, list(frame.columns))
+        backend.append_rows(name, fresh)
+        _log_cache(name).invalidate(full=True)
+        moved[month] = len(positions)
+        doomed.extend(int(p) + 2 for p in positions)
+    backend.delete_rows(PATROL_SHEET, doomed)
+    cache.invalidate(full=True)
+    _cache_versions().bump(PATROL_ARCHIVE_PREFIX)
+    return moved
+
+# ==========================================
+# 學生個人歷程 (巡查、請假、獎懲合併時間軸)
+#   三張紀錄表 (含巡查封存月份) 都在同步時維護 學號 → 列位置 索引，只取出該生的列。
+# ==========================================
+TIMELINE_COLUMNS = ["日期", "來源", "項目", "內容", "得分", "累計得分", "經辦人"]
+
+def _student_rows(sheet_name, student_id):
+    try:
+        frame, index = _log_cache(sheet_name).get_with_index(get_backend(), "student")
+    except Exception: return pd.DataFrame()
+    return as_text(frame.take(index.positions(student_id)))
+
+def student_timeline(student_id):
+    """單一學生的合併時間軸 (依日期排序)，巡查得分另附累計值。"""
+    parts = []
+    patrol = [frame.take(index.positions(student_id)) for frame, index in _patrol_indexes("0000-00-00", "9999-99-99", "student") if not frame.empty]
+    patrol = as_text(concat_typed(patrol)) if patrol else pd.DataFrame()
+    if not patrol.empty:
+        parts.append(pd.DataFrame({"日期": patrol["日期"], "來源": "巡查", "項目": patrol["狀況"], "內容": patrol["時間"],
+                                   "得分": pd.to_numeric(patrol["得分"], errors="coerce").fillna(0.0), "經辦人": patrol["回報人"]}))
+    leave = _student_rows("僑生請假紀錄", student_id)
+    if not leave.empty:
+        parts.append(pd.DataFrame({"日期": leave["起點日期"], "來源": "請假", "項目": leave["類別"],
+                                   "內容": leave["起點日期"] + " ~ " + leave["迄止日期"] + " " + leave["細節與時間"] + " " + leave["外宿地點"],
+                                   "經辦人": leave["經辦人"]}))
+    rewards = _student_rows("獎懲紀錄總表", student_id)
+    if not rewards.empty:
+        parts.append(pd.DataFrame({"日期": rewards["日期"], "來源": "獎懲", "項目": rewards["類別"] + "：" + rewards["獎懲項目"],
+                                   "內容": rewards["事由"] + " (" + rewards["建議次數"] + ")", "經辦人": rewards["導師簽名"]}))
+    if not parts: return pd.DataFrame(columns=TIMELINE_COLUMNS)
+    timeline = pd.concat(parts, ignore_index=True).reindex(columns=TIMELINE_COLUMNS)
+    timeline = timeline.sort_values(["日期", "內容"], kind="stable", ignore_index=True)
+    # 累計得分只隨巡查列變動，其他來源的列沿用前一筆的累計值
+    timeline["累計得分"] = timeline["得分"].fillna(0.0).cumsum().round(2)
+    timeline["內容"] = timeline["內容"].str.strip()
+    return timeline
+
+# ==========================================
+# 3. 專屬寫入通道
+# ==========================================
+@st.cache_resource
+def get_write_queue():
+    # 回呼在背景執行緒執行，先在此取得各紀錄表的快取物件，避免在背景呼叫 st 快取函式
+    caches = {name: _log_cache(name) for name in LOG_HEADERS}
+    def on_commit(sheet_name):
+        if sheet_name in caches: caches[sheet_name].invalidate()
+    def row_hint(sheet_name):
+        return caches[sheet_name].synced_rows + 1 if sheet_name in caches else 0
+    spool_path = _storage_config().get("write_spool_path", "write_spool.sqlite3")
+    return WriteQueue(get_backend(), spool_path, on_commit=on_commit, row_hint=row_hint)
+
+def append_log_rows(sheet_name, rows):
+    """把新增的紀錄排入背景寫入佇列，立即回傳批次編號 (可用 write_status 查詢進度)。"""
+    return get_write_queue().submit(sheet_name, rows, LOG_HEADERS.get(sheet_name))
+
+def write_status(batch_id):
+    return get_write_queue().status(batch_id)
+
+def diff_log_edits(original, edited):
+    """比對 data_editor 編輯前後的表格，回傳 (變更儲存格, 新增列, 刪除列號)。
+
+    original 的 index 必須是資料列位置 (第 i 列對應工作表第 i+2 列)，
+    也就是 load_log_data 回傳的表格或其切片。
+    """
+    cols = list(original.columns)
+    before = as_text(original)
+    after = as_text(edited.reindex(columns=cols))
+    kept = before.index.intersection(after.index)
+    deleted = [int(i) + 2 for i in before.index.difference(after.index)]
+    added = after.loc[after.index.difference(before.index)].values.tolist()
+    old_vals, new_vals = before.loc[kept].to_numpy(), after.loc[kept].to_numpy()
+    rr, cc = np.nonzero(old_vals != new_vals)
+    cells = [(int(kept[r]) + 2, int(c) + 1, new_vals[r, c]) for r, c in zip(rr, cc)]
+    return cells, added, deleted
+
+def save_log_edits(sheet_name, original, edited):
+    """只把差異寫回：一次批次更新變更的儲存格，接著附加新增列、刪除被移除的列。"""
+    cells, added, deleted = diff_log_edits(original, edited)
+    backend = get_backend()
+    backend.update_cells(sheet_name, cells)
+    backend.append_rows(sheet_name, added)
+    backend.delete_rows(sheet_name, deleted)
+    if cells or added or deleted: invalidate_log_data(sheet_name, full=True)
+    return len(cells), len(added), len(deleted)
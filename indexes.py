@@ -0,0 +1,288 @@
+from bisect import bisect_left, bisect_right
+from types import MappingProxyType
+
+import numpy as np
+import pandas as pd
+
+# ==========================================
+# 學生名單索引 (名單載入時建立一次，所有使用者共用，唯讀)
+# ==========================================
+class RosterIndex:
+    """學號 → 學生資料、班級 → 依座號排序的學生清單 (含顯示名稱)、(班級, 座號) → 學生。
+
+    每筆學生資料是唯讀的 mapping，可直接用 rec["姓名"] / rec.get("座號") 取值。
+    """
+
+    def __init__(self, df_students):
+        self.frame = df_students
+        if df_students.empty:
+            records = []
+        else:
+            records = df_students.assign(顯示名稱=df_students["座號"] + "-" + df_students["姓名"]).to_dict("records")
+
+        by_id, by_class = {}, {}
+        for r in records:
+            rec = MappingProxyType(r)
+            by_id[r["學號"]] = rec
+            by_class.setdefault(r["班級"], []).append(rec)
+        for recs in by_class.values():
+            recs.sort(key=lambda r: (r["座號"], r["學號"]))
+
+        self._by_id = MappingProxyType(by_id)
+        self._by_class = MappingProxyType({c: tuple(recs) for c, recs in by_class.items()})
+        self._display_names = MappingProxyType({c: tuple(r["顯示名稱"] for r in recs) for c, recs in by_class.items()})
+        self._by_seat = MappingProxyType({(r["班級"], r["座號"]): r for recs in by_class.values() for r in recs})
+        self._id_index = pd.Index(list(by_id), dtype=object)   # 批次比對學號用 (與 _id_records 同序)
+        self._id_records = tuple(by_id.values())
+
+    def __len__(self):
+        return len(self._by_id)
+
+    def __contains__(self, student_id):
+        return student_id in self._by_id
+
+    def get(self, student_id):
+        return self._by_id.get(student_id)
+
+    def lookup_many(self, student_ids):
+        """一次比對多個學號，回傳 (依輸入順序且去除重複的學生資料, 查無的學號)。"""
+        ids = pd.Series(list(student_ids), dtype=object).astype(str).str.strip()
+        ids = pd.unique(ids[ids != ""])
+        pos = self._id_index.get_indexer(ids)
+        return [self._id_records[p] for p in pos[pos >= 0]], ids[pos < 0].tolist()
+
+    def class_students(self, class_name):
+        return self._by_class.get(class_name, ())
+
+    def display_names(self, class_name):
+        return self._display_names.get(class_name, ())
+
+    def pick(self, class_name, display_names):
+        """依 multiselect 勾選的顯示名稱取回學生資料 (維持座號順序)。"""
+        chosen = set(display_names)
+        return [r for r in self.class_students(class_name) if r["顯示名稱"] in chosen]
+
+    def seat(self, class_name, seat_no):
+        return self._by_seat.get((class_name, str(seat_no).zfill(2)))
+
+
+# ==========================================
+# 紀錄表的衍生索引 (由 LogCache 在同步時維護)
+#   build(frame) 從整份表建立；extend(frame, start) 只處理第 start 列之後新增的列，
+#   回傳新的索引物件而不改動舊的，讓仍持有舊版表格的讀者看到一致的資料。
+# ==========================================
+class DateIndex:
+    """日期 → 資料列位置 的分區索引，日期範圍查詢只取出符合的分區。"""
+
+    def __init__(self, positions, column="日期"):
+        self.column = column
+        self._positions = positions            # {日期字串: np.ndarray(列位置)}
+        self._dates = sorted(positions)
+
+    @classmethod
+    def build(cls, frame, column="日期"):
+        if frame.empty or column not in frame.columns: return cls({}, column)
+        return cls(dict(frame.groupby(column, sort=False, observed=True).indices), column)
+
+    def extend(self, frame, start):
+        if frame.empty or self.column not in frame.columns: return self
+        positions = dict(self._positions)
+        for date, pos in frame[self.column].iloc[start:].groupby(frame[self.column].iloc[start:], sort=False, observed=True).indices.items():
+            pos = pos + start
+            positions[date] = np.concatenate([positions[date], pos]) if date in positions else pos
+        return DateIndex(positions, self.column)
+
+    @property
+    def dates(self):
+        return tuple(self._dates)
+
+    def positions(self, start_date, end_date=None):
+        """start_date ~ end_date (含) 的列位置，日期格式 YYYY-MM-DD。"""
+        end_date = end_date or start_date
+        lo, hi = bisect_left(self._dates, start_date), bisect_right(self._dates, end_date)
+        parts = [self._positions[d] for d in self._dates[lo:hi]]
+        return np.sort(np.concatenate(parts)) if parts else np.array([], dtype=np.intp)
+
+
+class StudentIndex:
+    """學號 → 資料列位置，查單一學生的紀錄不必整表比對。"""
+
+    def __init__(self, positions, column="學號"):
+        self.column = column
+        self._positions = positions            # {學號: np.ndarray(列位置)}
+
+    @staticmethod
+    def _groups(ids):
+        ids = ids.astype(str).str.strip()
+        return ids.groupby(ids, sort=False).indices
+
+    @classmethod
+    def build(cls, frame, column="學號"):
+        if frame.empty or column not in frame.columns: return cls({}, column)
+        return cls(dict(cls._groups(frame[column])), column)
+
+    def extend(self, frame, start):
+        if frame.empty or self.column not in frame.columns: return self
+        positions = dict(self._positions)
+        for sid, pos in self._groups(frame[self.column].iloc[start:]).items():
+            pos = pos + start
+            positions[sid] = np.concatenate([positions[sid], pos]) if sid in positions else pos
+        return StudentIndex(positions, self.column)
+
+    def positions(self, student_id):
+        return self._positions.get(str(student_id).strip(), np.array([], dtype=np.intp))
+
+
+class ScoreAggregates:
+    """巡查得分的物化彙總：(日期, 班級) → 得分合計與筆數，(日期, 班級, 狀況) → 筆數。
+
+    新同步的列只彙總那幾列再加進既有結果，查詢週/月/學期排行時不需重掃原始紀錄。
+    """
+
+    def __init__(self, daily, status):
+        self.daily = daily      # index (日期, 班級)，欄位 得分、筆數
+        self.status = status    # index (日期, 班級, 狀況) 的筆數 Series
+
+    @staticmethod
+    def _aggregate(frame):
+        empty = (pd.DataFrame({"得分": [], "筆數": []}, index=pd.MultiIndex.from_arrays([[], []], names=["日期", "班級"])),
+                 pd.Series([], index=pd.MultiIndex.from_arrays([[], [], []], names=["日期", "班級", "狀況"]), dtype="int64"))
+        if frame.empty or not {"日期", "班級", "狀況", "得分"} <= set(frame.columns): return empty
+        df = pd.DataFrame({
+            "日期": frame["日期"].astype(str), "班級": frame["班級"].astype(str), "狀況": frame["狀況"].astype(str),
+            "得分": pd.to_numeric(frame["得分"], errors="coerce").fillna(0.0),
+        })
+        df = df[df["班級"] != "-"]
+        if df.empty: return empty
+        daily = df.groupby(["日期", "班級"]).agg(得分=("得分", "sum"), 筆數=("得分", "size"))
+        status = df.groupby(["日期", "班級", "狀況"]).size()
+        return daily, status
+
+    @classmethod
+    def build(cls, frame):
+        return cls(*cls._aggregate(frame))
+
+    def extend(self, frame, start):
+        daily, status = self._aggregate(frame.iloc[start:])
+        return self.merge(ScoreAggregates(daily, status))
+
+    def merge(self, other):
+        return ScoreAggregates(self.daily.add(other.daily, fill_value=0).sort_index(),
+                               self.status.add(other.status, fill_value=0).astype("int64").sort_index())
+
+    def leaderboard(self, start_date, end_date, classes):
+        """start_date ~ end_date (含) 各班總分排行；classes 中沒有紀錄的班級以 0 分列入。"""
+        daily = self.daily.loc[start_date:end_date] if not self.daily.empty else self.daily
+        status = self.status.loc[start_date:end_date] if not self.status.empty else self.status
+        board = daily.groupby(level="班級").sum().reindex(classes, fill_value=0)
+        if not status.empty:
+            board = board.join(status.groupby(level=["班級", "狀況"]).sum().unstack(fill_value=0), how="left")
+        board = board.fillna(0)
+        board["得分"] = board["得分"].round(2)
+        board = board.astype({c: "int64" for c in board.columns if c != "得分"})
+        board = board.sort_values(["得分", "筆數"], ascending=[False, True]).rename_axis("班級").reset_index()
+        board.insert(0, "名次", board["得分"].rank(method="min", ascending=False).astype("int64"))
+        return board
+
+    def trend(self, start_date, end_date, classes):
+        """日期 × 班級 的累計得分 (給折線圖用)。"""
+        daily = self.daily.loc[start_date:end_date] if not self.daily.empty else self.daily
+        pivot = daily["得分"].unstack("班級", fill_value=0).reindex(columns=classes, fill_value=0)
+        return pivot.sort_index().cumsum().round(2)
+
+
+def _day_numbers(values):
+    """YYYY-MM-DD 字串 → 自 1970-01-01 起的天數 (int64)；無法解析的為 -1。"""
+    days = pd.to_datetime(pd.Series(values, dtype=object).astype(str).str.strip(), format="%Y-%m-%d", errors="coerce")
+    out = days.to_numpy(dtype="datetime64[D]").astype(np.int64)
+    out[days.isna().to_numpy()] = -1
+    return out
+
+
+def day_number(value):
+    return int(np.datetime64(str(value)[:10], "D").astype(np.int64))
+
+
+class LeaveIntervals:
+    """請假期間 (起點日期 ~ 迄止日期) 的區間索引：某日在外的學生、同一學號重疊的假單。
+
+    一般假單依起點排序，且長度不超過 max_span 天，查詢某日只要二分搜尋起點落在
+    [D - max_span, D] 的區段；超過 LONG_SPAN 天的長假 (職場實習等) 另外存放，數量很少直接比對。
+    """
+
+    LONG_SPAN = 31
+
+    def __init__(self, starts, ends, students, order, long_pos, max_span):
+        self._starts = starts        # 各列的起點 / 迄止天數 (依資料列位置，-1 代表日期無法解析)
+        self._ends = ends
+        self._students = students    # {學號: np.ndarray(列位置)}
+        self._order = order          # 一般假單的列位置，依起點排序
+        self._sorted_starts = starts[order]
+        self._long = long_pos
+        self._max_span = max_span
+
+    @staticmethod
+    def _columns(frame):
+        starts = _day_numbers(frame["起點日期"])
+        ends = _day_numbers(frame["迄止日期"])
+        ends = np.where((ends < starts) | (ends < 0), starts, ends)   # 迄止日期空白或早於起點，視為單日
+        return starts, ends
+
+    @classmethod
+    def _assemble(cls, starts, ends, students, order_parts, long_parts):
+        valid = starts >= 0
+        pos = np.concatenate(order_parts) if order_parts else np.array([], dtype=np.intp)
+        pos = pos[valid[pos]]
+        order = pos[np.argsort(starts[pos], kind="stable")]
+        long_pos = np.concatenate(long_parts) if long_parts else np.array([], dtype=np.intp)
+        max_span = int((ends[order] - starts[order]).max()) if len(order) else 0
+        return cls(starts, ends, students, order, long_pos[valid[long_pos]], max_span)
+
+    @classmethod
+    def _split(cls, starts, ends, offset=0):
+        pos = np.arange(offset, offset + len(starts), dtype=np.intp)
+        is_long = (ends - starts) > cls.LONG_SPAN
+        return pos[~is_long], pos[is_long]
+
+    @classmethod
+    def build(cls, frame):
+        empty = np.array([], dtype=np.int64)
+        if frame.empty or not {"起點日期", "迄止日期", "學號"} <= set(frame.columns):
+            return cls(empty, empty, {}, np.array([], dtype=np.intp), np.array([], dtype=np.intp), 0)
+        starts, ends = cls._columns(frame)
+        short, long_ = cls._split(starts, ends)
+        ids = frame["學號"].astype(str).str.strip()
+        students = dict(ids.groupby(ids, sort=False).indices)
+        return cls._assemble(starts, ends, students, [short], [long_])
+
+    def extend(self, frame, start):
+        if frame.empty or not {"起點日期", "迄止日期", "學號"} <= set(frame.columns): return self
+        new = frame.iloc[start:]
+        n_starts, n_ends = self._columns(new)
+        short, long_ = self._split(n_starts, n_ends, start)
+        students = dict(self._students)
+        ids = new["學號"].astype(str).str.strip()
+        for sid, pos in ids.groupby(ids, sort=False).indices.items():
+            pos = pos + start
+            students[sid] = np.concatenate([students[sid], pos]) if sid in students else pos
+        return LeaveIntervals._assemble(np.concatenate([self._starts, n_starts]), np.concatenate([self._ends, n_ends]),
+                                        students, [self._order, short], [self._long, long_])
+
+    def positions_on(self, date):
+        """date 當天 (含起訖日) 請假在外的列位置 (遞增排序)。"""
+        d = day_number(date)
+        lo = np.searchsorted(self._sorted_starts, d - self._max_span, side="left")
+        hi = np.searchsorted(self._sorted_starts, d, side="right")
+        window = self._order[lo:hi]
+        hits = window[self._ends[window] >= d]
+        longs = self._long[(self._starts[self._long] <= d) & (self._ends[self._long] >= d)]
+        return np.sort(np.concatenate([hits, longs]))
+
+    def overlapping(self, student_id, start_date, end_date=None):
+        """同一學號中與 start_date ~ end_date 有重疊的假單列位置。"""
+        pos = self._students.get(str(student_id).strip())
+        if pos is None: return np.array([], dtype=np.intp)
+        lo = day_number(start_date)
+        hi = max(day_number(end_date or start_date), lo)
+        hit = (self._starts[pos] >= 0) & (self._starts[pos] <= hi) & (self._ends[pos] >= lo)
+        return np.sort(pos[hit])
@@ -0,0 +1,125 @@
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)  # 延遲分布的分界 (秒)
+
+
+def _bucket_label(i):
+    if i == len(LATENCY_BUCKETS): return f">{LATENCY_BUCKETS[-1]:g}s"
+    bound = LATENCY_BUCKETS[i]
+    return f"≤{bound * 1000:g}ms" if bound < 1 else f"≤{bound:g}s"
+
+
+def _status_code(e):
+    return getattr(getattr(e, "response", None), "status_code", None)
+
+
+# ==========================================
+# 效能監控 (行程內共用)
+#   記錄每一次試算表 API 呼叫的延遲分布、次數、資料列數與配額限制 (429)，
+#   各快取的命中/未命中，以及每次重跑 (rerun) 的總耗時。
+# ==========================================
+class Metrics:
+    def __init__(self, max_reruns=1000):
+        self._lock = threading.Lock()
+        self._max_reruns = max_reruns
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.started = time.time()
+            self._calls = {}       # (操作, 工作表) → 統計
+            self._cache = {}       # (快取, 事件) → 次數
+            self._reruns = deque(maxlen=self._max_reruns)
+
+    @contextmanager
+    def timed(self, op, sheet=""):
+        """計時一次 API 呼叫；可在 with 區塊內設定 call["rows"] 記錄資料列數。"""
+        call = {"rows": 0}
+        error = None
+        start = time.perf_counter()
+        try:
+            yield call
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            self._record_call(op, sheet, time.perf_counter() - start, call["rows"], error)
+
+    def _record_call(self, op, sheet, seconds, rows, error):
+        bucket = int(np.searchsorted(LATENCY_BUCKETS, seconds))
+        with self._lock:
+            s = self._calls.setdefault((op, sheet), {"count": 0, "errors": 0, "rate_limited": 0, "rows": 0,
+                                                     "total": 0.0, "max": 0.0, "buckets": [0] * (len(LATENCY_BUCKETS) + 1)})
+            s["count"] += 1
+            s["rows"] += rows
+            s["total"] += seconds
+            s["max"] = max(s["max"], seconds)
+            s["buckets"][bucket] += 1
+            if error is not None:
+                s["errors"] += 1
+                if _status_code(error) == 429: s["rate_limited"] += 1
+
+    def record_cache(self, cache, event):
+        """event 為 "hit" 或 "miss"。"""
+        with self._lock:
+            self._cache[(cache, event)] = self._cache.get((cache, event), 0) + 1
+
+    def cache_count(self, cache, event):
+        with self._lock:
+            return self._cache.get((cache, event), 0)
+
+    def record_rerun(self, seconds):
+        with self._lock:
+            self._reruns.append(seconds)
+
+    # ---------- 報表 ----------
+    def calls_frame(self):
+        with self._lock:
+            items = [(k, dict(v, buckets=list(v["buckets"]))) for k, v in self._calls.items()]
+        rows = []
+        for (op, sheet), s in items:
+            row = {"操作": op, "工作表": sheet, "次數": s["count"], "錯誤": s["errors"], "429": s["rate_limited"],
+                   "資料列數": s["rows"], "平均 (ms)": round(s["total"] / s["count"] * 1000, 1),
+                   "最大 (ms)": round(s["max"] * 1000, 1), "累計 (s)": round(s["total"], 2)}
+            row.update({_bucket_label(i): n for i, n in enumerate(s["buckets"])})
+            rows.append(row)
+        if not rows: return pd.DataFrame(columns=["操作", "工作表", "次數", "錯誤", "429", "資料列數", "平均 (ms)", "最大 (ms)", "累計 (s)"])
+        return pd.DataFrame(rows).sort_values("累計 (s)", ascending=False, ignore_index=True)
+
+    def latency_histogram(self):
+        """全部 API 呼叫合計的延遲分布 (各區間的次數)。"""
+        with self._lock:
+            totals = np.sum([v["buckets"] for v in self._calls.values()], axis=0) if self._calls else np.zeros(len(LATENCY_BUCKETS) + 1, dtype=int)
+        return pd.Series(totals, index=[_bucket_label(i) for i in range(len(totals))], name="次數")
+
+    def cache_frame(self):
+        with self._lock:
+            counts = dict(self._cache)
+        names = sorted({c for c, _ in counts})
+        rows = []
+        for c in names:
+            hit, miss = counts.get((c, "hit"), 0), counts.get((c, "miss"), 0)
+            rows.append({"快取": c, "命中": hit, "未命中": miss, "命中率": round(hit / (hit + miss), 3) if hit + miss else 0.0})
+        return pd.DataFrame(rows, columns=["快取", "命中", "未命中", "命中率"])
+
+    def rerun_summary(self):
+        with self._lock:
+            reruns = np.array(self._reruns, dtype=float)
+        if not len(reruns): return {"次數": 0, "平均 (ms)": 0.0, "p50 (ms)": 0.0, "p95 (ms)": 0.0, "最大 (ms)": 0.0}
+        p50, p95 = np.percentile(reruns, [50, 95]) * 1000
+        return {"次數": len(reruns), "平均 (ms)": round(float(reruns.mean()) * 1000, 1), "p50 (ms)": round(float(p50), 1),
+                "p95 (ms)": round(float(p95), 1), "最大 (ms)": round(float(reruns.max()) * 1000, 1)}
+
+    def export_csv(self):
+        """API 呼叫、快取與重跑統計合併成一份 CSV (以「類別」欄區分)。"""
+        parts = [self.calls_frame().assign(類別="API 呼叫"),
+                 self.cache_frame().assign(類別="快取"),
+                 pd.DataFrame([self.rerun_summary()]).assign(類別="重跑")]
+        out = pd.concat(parts, ignore_index=True).convert_dtypes()
+        return out[["類別"] + [c for c in out.columns if c != "類別"]].to_csv(index=False).encode("utf-8-sig")
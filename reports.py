@@ -0,0 +1,226 @@
+import hashlib
+import html
+import io
+import json
+import re
+import threading
+import zipfile
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from string import Template
+
+import pandas as pd
+
+# ==========================================
+# 列印報表引擎
+#   樣板在模組載入時編譯一次；表格列以整欄向量化的方式組字串 (含 HTML 跳脫)；
+#   產出的 HTML 依內容雜湊快取，session 只需保存產生報表的原始資料。
+# ==========================================
+_ESCAPES = (("&", "&amp;"), ("<", "&lt;"), (">", "&gt;"), ('"', "&quot;"), ("'", "&#x27;"))
+EMPTY_ROW = "<tr><td colspan='10'>無紀錄</td></tr>"
+
+
+def escape_column(s):
+    s = s.fillna("").astype(str)
+    for raw, safe in _ESCAPES:
+        s = s.str.replace(raw, safe, regex=False)
+    return s
+
+
+class Cell:
+    """表格中的一格：一或多個欄位 (以 <br> 串接) 與 <td> 屬性。"""
+
+    def __init__(self, *columns, attrs=""):
+        self.columns = columns
+        self.attrs = f" {attrs}" if attrs else ""
+
+
+def render_rows(df, cells, empty_html=EMPTY_ROW):
+    """把 DataFrame 轉成 <tr> 字串；cells 的每一項為欄名或 Cell。"""
+    if df.empty: return empty_html
+    cells = [c if isinstance(c, Cell) else Cell(c) for c in cells]
+    escaped = {c: escape_column(df[c]) if c in df.columns else pd.Series("", index=df.index)
+               for cell in cells for c in cell.columns}
+    out = pd.Series("<tr>", index=df.index)
+    for cell in cells:
+        content = escaped[cell.columns[0]]
+        for c in cell.columns[1:]: content = content + "<br>" + escaped[c]
+        out = out + f"<td{cell.attrs}>" + content + "</td>"
+    return "".join((out + "</tr>").tolist())
+
+
+# ==========================================
+# 依內容雜湊快取產出的 HTML (行程內共用，LRU)
+# ==========================================
+class _ReportMemo:
+    def __init__(self, max_entries=64):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._items = OrderedDict()
+
+    def get_or_render(self, kind, payload, render):
+        key = content_key(kind, payload)
+        with self._lock:
+            if key in self._items:
+                self._items.move_to_end(key)
+                return self._items[key]
+        out = render()
+        with self._lock:
+            self._items[key] = out
+            while len(self._items) > self.max_entries: self._items.popitem(last=False)
+        return out
+
+
+_memo = _ReportMemo()
+
+
+def content_key(kind, payload):
+    """報表內容雜湊；payload 中的 DataFrame 以 pandas 向量化雜湊處理，不逐列序列化。"""
+    h = hashlib.sha1(kind.encode("utf-8"))
+    for name, value in sorted(payload.items()):
+        h.update(name.encode("utf-8"))
+        if isinstance(value, pd.DataFrame):
+            h.update(json.dumps(list(map(str, value.columns)), ensure_ascii=False).encode("utf-8"))
+            h.update(pd.util.hash_pandas_object(value, index=False).values.tobytes())
+        else:
+            h.update(json.dumps(value, ensure_ascii=False, sort_keys=True, default=str).encode("utf-8"))
+    return h.hexdigest()
+
+
+# ==========================================
+# 樣板
+# ==========================================
+LEAVE_TEMPLATE = Template("""
+<!DOCTYPE html><html><head><meta charset="utf-8"><style>
+    body { font-family: "Microsoft JhengHei", sans-serif; padding: 20px; }
+    @media print { #btn { display: none !important; } @page { size: A4 landscape; margin: 15mm; } }
+    #btn { margin-bottom: 20px; padding: 12px; background: #FF4B4B; color: white; border: none; width: 100%; font-size: 18px; font-weight: bold; cursor: pointer; }
+    .title { text-align: center; font-size: 24px; font-weight: bold; margin-bottom: 20px; border-bottom: 2px solid black; padding-bottom: 10px; }
+    table { width: 100%; border-collapse: collapse; font-size: 13px; } th, td { border: 1px solid black; padding: 8px; text-align: center; } th { background-color: #f2f2f2; }
+    .sig { display: flex; justify-content: space-between; margin-top: 80px; } .box { text-align: center; width: 18%; font-weight: bold; font-size: 16px; }
+</style></head><body>
+    <button id="btn" onclick="window.print()">🖨️ 點此列印 (請存為 PDF)</button>
+    <div class="title">樹人家商 ${class_name} 僑生外散(宿)集體申請單</div>
+    <table><thead><tr><th>座號</th><th>姓名</th><th>類別</th><th>申請日期</th><th>返校/宿時間</th><th>地點/事由/親友資訊</th><th>學生手機</th><th>家長電話</th></tr></thead><tbody>${rows}</tbody></table>
+    <div class="sig"><div class="box">導師<br><br></div><div class="box">生輔組長<br><br></div><div class="box">學務主任<br><br></div><div class="box">國際交流組<br><br></div><div class="box">招生中心<br><br></div></div>
+</body></html>
+""")
+
+REWARD_TEMPLATE = Template("""
+<!DOCTYPE html><html><head><meta charset="utf-8"><style>
+    body { font-family: "Microsoft JhengHei", sans-serif; padding: 20px; }
+    @media print { #btn { display: none !important; } @page { size: A4 portrait; margin: 15mm; } }
+    #btn { margin-bottom: 20px; padding: 12px; background: #FF4B4B; color: white; border: none; width: 100%; font-size: 18px; font-weight: bold; cursor: pointer; }
+    .title { text-align: center; font-size: 24px; font-weight: bold; margin-bottom: 5px; }
+    .subtitle { text-align: right; font-size: 14px; margin-bottom: 10px; }
+    table { width: 100%; border-collapse: collapse; font-size: 14px; } th, td { border: 1px solid black; padding: 10px; text-align: center; } th { background-color: #f2f2f2; }
+    .sig { display: flex; justify-content: space-between; margin-top: 60px; } .box { text-align: center; width: 22%; font-weight: bold; font-size: 16px; border-top: 1px dotted black; padding-top: 10px; }
+</style></head><body>
+    <button id="btn" onclick="window.print()">🖨️ 點此列印 ${main_type}建議單</button>
+    <div class="title">新北市私立樹人家商${main_type}建議單</div>
+    <div class="subtitle">造冊日期：${report_date}</div>
+    <table><thead><tr><th width="5%">項次</th><th width="12%">學號</th><th width="12%">班級</th><th width="12%">座號姓名</th><th width="10%">類別</th><th width="35%">獎懲事由</th><th width="7%">建議</th><th width="7%">簽名</th></tr></thead><tbody>${rows}</tbody></table>
+    <div class="sig"><div class="box">簽辦人</div><div class="box">輔導教官</div><div class="box">主任教官</div><div class="box">學務主任</div></div>
+</body></html>
+""")
+
+DAILY_TEMPLATE = Template("""
+<!DOCTYPE html><html><head><meta charset="utf-8"><style>
+    body { font-family: "Microsoft JhengHei", sans-serif; padding: 20px; }
+    @media print { #btn-rpt { display: none !important; } @page { size: A4 portrait; margin: 15mm; } }
+    #btn-rpt { margin-bottom: 20px; padding: 12px; background: #FF4B4B; color: white; border: none; width: 100%; font-size: 18px; font-weight: bold; cursor: pointer; }
+    .title { text-align: center; font-size: 24px; font-weight: bold; margin-bottom: 20px; border-bottom: 2px solid black; padding-bottom: 10px; }
+    h3 { margin-top: 20px; font-size: 16px; border-left: 4px solid #333; padding-left: 10px; }
+    table { width: 100%; border-collapse: collapse; margin-bottom: 15px; font-size: 13px; } th, td { border: 1px solid black; padding: 6px; text-align: center; } th { background-color: #e0e0e0; }
+    .sig { display: flex; justify-content: space-between; margin-top: 60px; } .box { text-align: center; width: 22%; font-weight: bold; font-size: 16px; border-top: 1px dashed gray; padding-top: 10px; }
+</style></head><body>
+    <button id="btn-rpt" onclick="window.print()">🖨️ 點此列印呈核報表</button>
+    <div class="title">樹人家商 每日校園巡查呈核紀錄表</div>
+    <div style="text-align: right; margin-bottom: 10px;">報表日期：${report_date}</div>
+    <h3>一、 上課巡查紀錄</h3><table><thead><tr><th>時間</th><th>班級</th><th>狀況</th><th>加扣分</th><th>回報人</th></tr></thead><tbody>${class_rows}</tbody></table>
+    <h3>二、 午間巡查紀錄</h3><table><thead><tr><th>時間</th><th>班級</th><th>狀況</th><th>加扣分</th><th>回報人</th></tr></thead><tbody>${noon_rows}</tbody></table>
+    <h3>三、 當日違規學生名單</h3><table><thead><tr><th>時間</th><th>班級</th><th>學號</th><th>姓名</th><th>違規狀況</th><th>加扣分</th><th>回報人</th></tr></thead><tbody>${personal_rows}</tbody></table>
+    <div class="sig"><div class="box">承辦人</div><div class="box">學務處主管</div><div class="box">教務處主管</div><div class="box">校長</div></div>
+</body></html>
+""")
+
+LEAVE_CELLS = ["座號", "姓名", "類別", "起訖日期", "返校時間", Cell("事由與細節", "親友資訊"), "學生手機", "家長電話"]
+REWARD_CELLS = ["項次", "學號", "班級", "座號姓名", "獎懲項目", Cell("事由", attrs="style='text-align:left;'"), "建議次數", "導師簽名"]
+CLASS_CELLS = ["時間", "班級", "狀況", "得分", "回報人"]
+PERSONAL_CELLS = ["時間", "班級", "學號", "姓名", "狀況", "得分", "回報人"]
+
+
+# ==========================================
+# 各式報表
+# ==========================================
+def leave_form(rows, class_name):
+    """僑生外散(宿)集體申請單；rows 為假單清單 (dict 串列)。"""
+    def render():
+        return LEAVE_TEMPLATE.substitute(class_name=html.escape(str(class_name)), rows=render_rows(pd.DataFrame(rows), LEAVE_CELLS))
+    return _memo.get_or_render("leave", {"rows": rows, "class_name": class_name}, render)
+
+
+def reward_form(rows, report_date):
+    """獎懲建議單；rows 為建議清單 (dict 串列)，依第一筆的類別決定為獎勵或懲處。"""
+    def render():
+        df = pd.DataFrame(rows)
+        df.insert(0, "項次", range(1, len(df) + 1))
+        main_type = "獎勵" if rows and rows[0].get("類別") == "獎勵" else "懲處"
+        return REWARD_TEMPLATE.substitute(main_type=main_type, report_date=report_date, rows=render_rows(df, REWARD_CELLS))
+    return _memo.get_or_render("reward", {"rows": rows, "date": report_date}, render)
+
+
+def daily_patrol_report(df_day, report_date):
+    """每日校園巡查呈核紀錄表；df_day 為當日的巡查紀錄。"""
+    def render():
+        is_class = df_day["對象"] == "班級"
+        is_noon = df_day["時間"].str.contains("午休", na=False, regex=False)
+        return DAILY_TEMPLATE.substitute(
+            report_date=report_date,
+            class_rows=render_rows(df_day[is_class & ~is_noon], CLASS_CELLS),
+            noon_rows=render_rows(df_day[is_class & is_noon], CLASS_CELLS),
+            personal_rows=render_rows(df_day[df_day["對象"] == "個人"], PERSONAL_CELLS),
+        )
+    return _memo.get_or_render("daily", {"frame": df_day, "date": report_date}, render)
+
+
+# ==========================================
+# 批次匯出 (多班表單一次產出)
+#   jobs 為 [(檔名, 產生 HTML 的無參數函式)]，以執行緒池並行產生後
+#   打包成 ZIP，或合併成一份每班一頁的列印檔。
+# ==========================================
+_PRINT_BUTTON = re.compile(r"<button id=\"btn[^\"]*\"[^>]*>.*?</button>", re.S)
+_BODY = re.compile(r"<body>(.*)</body>", re.S)
+PAGE_BREAK = "<div style='page-break-after: always; break-after: page;'></div>"
+EMPTY_BATCH = ("無紀錄.html", "<html><head><meta charset='utf-8'></head><body><p>此期間沒有紀錄。</p></body></html>")
+
+
+def render_batch(jobs, max_workers=8):
+    """並行產生各份表單，回傳 [(檔名, HTML)]，順序與 jobs 相同。"""
+    if not jobs: return []
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(jobs))) as pool:
+        pages = list(pool.map(lambda job: job[1](), jobs))
+    return [(name, page) for (name, _), page in zip(jobs, pages)]
+
+
+def zip_documents(docs):
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED) as zf:
+        for name, page in docs: zf.writestr(name, page)
+    return buf.getvalue()
+
+
+def combine_documents(docs):
+    """把同一種樣板產生的多份表單合併成一份，每份之間分頁，只保留最上方一個列印按鈕。"""
+    if not docs: return ""
+    first = docs[0][1]
+    head, tail = first[:first.index("<body>") + len("<body>")], first[first.index("</body>"):]
+    button = _PRINT_BUTTON.search(first)
+    bodies = [_PRINT_BUTTON.sub("", _BODY.search(page).group(1)) for _, page in docs]
+    return head + (button.group(0) if button else "") + PAGE_BREAK.join(bodies) + tail
+
+
+def export_batch(jobs, combined=False):
+    """產生批次匯出的檔案內容 (bytes)：combined=True 為合併列印的 HTML，否則為 ZIP。"""
+    docs = render_batch(jobs) or [EMPTY_BATCH]
+    return combine_documents(docs).encode("utf-8") if combined else zip_documents(docs)
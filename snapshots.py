@@ -0,0 +1,75 @@
+import json
+import logging
+import os
+import re
+import tempfile
+import time
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # 沒有 pyarrow 時停用快照，照常從後端讀取
+    pa = pq = None
+
+logger = logging.getLogger(__name__)
+
+META_KEY = b"school_snapshot"
+
+
+# ==========================================
+# 本機快照 (冷啟動加速)
+#   每張表的 DataFrame 存成一個 Parquet 檔 (保留 category 型別)，
+#   同步資訊 (標題列、最後一列、已同步列數…) 放在檔案的 schema metadata 裡，
+#   與資料一起以「寫暫存檔再 os.replace」的方式原子更新，不會讀到一半的檔案。
+# ==========================================
+class SnapshotStore:
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def available():
+        return pq is not None
+
+    def _path(self, name):
+        safe = re.sub(r'[\\/:*?"<>|]', "_", name)
+        return os.path.join(self.directory, f"{safe}.parquet")
+
+    def save(self, name, frame, meta=None):
+        """把表格與同步資訊寫入快照；失敗只記錄警告，不影響正常流程。"""
+        if pq is None: return False
+        try:
+            table = pa.Table.from_pandas(frame, preserve_index=False)
+            info = dict(meta or {}, saved_at=time.time())
+            table = table.replace_schema_metadata({**(table.schema.metadata or {}),
+                                                   META_KEY: json.dumps(info, ensure_ascii=False).encode("utf-8")})
+            fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+            os.close(fd)
+            try:
+                pq.write_table(table, tmp)
+                os.replace(tmp, self._path(name))
+            finally:
+                if os.path.exists(tmp): os.remove(tmp)
+            return True
+        except Exception:
+            logger.warning("寫入 %s 的快照失敗", name, exc_info=True)
+            return False
+
+    def load(self, name):
+        """回傳 (DataFrame, 同步資訊)；沒有快照或檔案損毀時回傳 None。"""
+        if pq is None: return None
+        path = self._path(name)
+        if not os.path.exists(path): return None
+        try:
+            table = pq.read_table(path)
+            meta = json.loads((table.schema.metadata or {}).get(META_KEY, b"{}").decode("utf-8"))
+            return table.to_pandas(), meta
+        except Exception:
+            logger.warning("讀取 %s 的快照失敗，改從後端重新載入", name, exc_info=True)
+            return None
+
+    def discard(self, name):
+        try:
+            os.remove(self._path(name))
+        except FileNotFoundError:
+            pass
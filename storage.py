@@ -0,0 +1,382 @@
+import json
+import logging
+import sqlite3
+import threading
+
+import gspread
+
+from metrics import Metrics
+
+logger = logging.getLogger(__name__)
+
+# ==========================================
+# 儲存後端共用常數
+# ==========================================
+DB_NAME = "全校巡查總資料庫"
+PATROL_SHEET = "巡查紀錄"  # 巡查紀錄固定放在試算表的第一個工作表 (sheet1)
+
+
+class SheetNotFound(Exception):
+    """指定的工作表不存在。"""
+
+
+# ==========================================
+# 儲存後端介面
+# ==========================================
+class StorageBackend:
+    """以「工作表名稱 + 列」模擬試算表的儲存介面。
+
+    所有讀取皆回傳 get_all_values() 形式的二維字串串列，第 1 列為標題列，
+    讓上層的 safe_get_dataframe 不需要知道資料實際放在哪裡。
+    """
+
+    def list_sheets(self):
+        raise NotImplementedError
+
+    def has_sheet(self, name):
+        return name in self.list_sheets()
+
+    def get_values(self, name):
+        raise NotImplementedError
+
+    def get_many(self, names):
+        """一次讀取多張工作表，回傳 {名稱: 二維串列}；不存在的工作表對應 None。"""
+        out = {}
+        for name in names:
+            try:
+                out[name] = self.get_values(name)
+            except SheetNotFound:
+                out[name] = None
+        return out
+
+    def get_tail(self, name, start_row):
+        """增量讀取：一次取回 (標題列, 第 start_row-1 列, 第 start_row 列之後所有列)。
+
+        中間那一列是上次同步的最後一列，供呼叫端比對是否有資料被刪改；
+        回傳 None 代表無法增量讀取，呼叫端應改為整份重讀。
+        """
+        values = self.get_values(name)
+        anchor = values[start_row - 2] if 0 <= start_row - 2 < len(values) else []
+        return (values[0] if values else []), anchor, values[start_row - 1:]
+
+    def create_sheet(self, name, headers=None, rows=2000):
+        raise NotImplementedError
+
+    def append_rows(self, name, rows):
+        raise NotImplementedError
+
+    def overwrite(self, name, values):
+        raise NotImplementedError
+
+    def update_cells(self, name, cells):
+        """批次更新儲存格，cells 為 (列號, 欄號, 值) 串列 (皆 1 起算)。"""
+        raise NotImplementedError
+
+    def delete_rows(self, name, row_numbers):
+        """刪除指定列號 (1 起算)，下方的列會往上遞補，與試算表行為一致。"""
+        raise NotImplementedError
+
+    def ensure_sheet(self, name, headers=None):
+        if not self.has_sheet(name): self.create_sheet(name, headers)
+
+
+# ==========================================
+# 後端一：Google 試算表 (gspread)
+# ==========================================
+class GSheetsBackend(StorageBackend):
+    """Spreadsheet 與「名稱 → Worksheet」對照表在行程內只開一次。
+
+    只有在找不到工作表，或 API 回報範圍無法解析 (工作表被改名/刪除) 時才重新抓一次中繼資料。
+    每次實際呼叫 API 都透過 metrics.timed 記錄延遲與資料列數。
+    """
+
+    def __init__(self, client, doc_name=DB_NAME, metrics=None):
+        self.client = client
+        self.doc_name = doc_name
+        self.metrics = metrics or Metrics()
+        self._lock = threading.RLock()
+        self._doc_handle = None
+        self._handles = None
+
+    def _doc(self):
+        with self._lock:
+            if self._doc_handle is None:
+                with self.metrics.timed("open"): self._doc_handle = self.client.open(self.doc_name)
+            return self._doc_handle
+
+    def _refresh_handles(self):
+        with self._lock:
+            doc = self._doc()
+            with self.metrics.timed("worksheets"): worksheets = doc.worksheets()
+            self._handles = {ws.title: ws for ws in worksheets}
+            if worksheets: self._handles[PATROL_SHEET] = worksheets[0]  # 對應原本的 doc.sheet1
+            return self._handles
+
+    def _worksheet(self, name):
+        handles = self._handles if self._handles is not None else self._refresh_handles()
+        if name not in handles: handles = self._refresh_handles()
+        if name not in handles: raise SheetNotFound(name)
+        return handles[name]
+
+    @staticmethod
+    def _is_range_error(e):
+        return getattr(e.response, "status_code", None) == 400
+
+    def _call(self, name, op, fn, rows=0):
+        """在快取的 Worksheet 上執行 fn；若工作表已被改名或刪除，重抓一次對照表再試。"""
+        def run():
+            ws = self._worksheet(name)
+            with self.metrics.timed(op, name) as call:
+                result = fn(ws)
+                call["rows"] = len(result) if rows is None else rows
+            return result
+        try:
+            return run()
+        except gspread.exceptions.APIError as e:
+            if not self._is_range_error(e): raise
+            self._refresh_handles()
+            return run()
+
+    def list_sheets(self):
+        return list(self._refresh_handles())
+
+    def has_sheet(self, name):
+        try:
+            self._worksheet(name)
+            return True
+        except SheetNotFound:
+            return False
+
+    def get_values(self, name):
+        return self._call(name, "get_all_values", lambda ws: ws.get_all_values(), rows=None)
+
+    def get_many(self, names):
+        """以一次 values_batch_get 讀回多張工作表；是否存在由快取的對照表判斷 (找不到才重抓一次)。"""
+        def fetch():
+            handles = self._handles if self._handles is not None else self._refresh_handles()
+            if any(n not in handles for n in names): handles = self._refresh_handles()
+            present = [n for n in names if n in handles]
+            if not present: return {}
+            ranges = ["'" + handles[n].title.replace("'", "''") + "'" for n in present]
+            doc = self._doc()
+            with self.metrics.timed("values_batch_get", "、".join(present)) as call:
+                value_ranges = doc.values_batch_get(ranges).get("valueRanges", [])
+                call["rows"] = sum(len(v.get("values", [])) for v in value_ranges)
+            # API 會省略列尾的空白儲存格，補齊成與 get_all_values() 相同的矩形
+            return {n: gspread.utils.fill_gaps(v["values"]) if v.get("values") else [] for n, v in zip(present, value_ranges)}
+        try:
+            found = fetch()
+        except gspread.exceptions.APIError as e:
+            if not self._is_range_error(e): raise
+            self._refresh_handles()
+            found = fetch()
+        return {n: found.get(n) for n in names}
+
+    def get_tail(self, name, start_row):
+        ws = self._worksheet(name)
+        last_col = gspread.utils.rowcol_to_a1(1, ws.col_count)[:-1]
+        # 尾端從上次同步的最後一列 (anchor) 起讀：這一列一定在格線範圍內。
+        # 若從下一列起讀，沒有新資料且工作表格線剛好到資料結尾時，API 會回 400 (超出格線) 而被誤判成要整份重讀。
+        try:
+            with self.metrics.timed("batch_get", name) as call:
+                header, rows = ws.batch_get(["1:1", f"A{start_row - 1}:{last_col}"])
+                call["rows"] = len(rows)
+        except gspread.exceptions.APIError as e:
+            if not self._is_range_error(e): raise
+            return None  # 例如列已被刪到比上次同步還少，或工作表被改名，交給整份重讀處理
+        anchor, rows = (rows[0], rows[1:]) if rows else ([], [])
+        return (header[0] if header else []), list(anchor), [list(r) for r in rows]
+
+    def create_sheet(self, name, headers=None, rows=2000):
+        doc = self._doc()
+        try:
+            with self.metrics.timed("add_worksheet", name):
+                ws = doc.add_worksheet(title=name, rows=str(rows), cols=max(15, len(headers) if headers else 15))
+        except gspread.exceptions.APIError:
+            # 可能已被其他人建立，重抓對照表確認
+            if name not in self._refresh_handles(): raise
+            return
+        with self._lock:
+            if self._handles is not None: self._handles[name] = ws
+        if headers:
+            with self.metrics.timed("append_row", name) as call:
+                ws.append_row(headers)
+                call["rows"] = 1
+
+    def append_rows(self, name, rows):
+        if rows: self._call(name, "append_rows", lambda ws: ws.append_rows(rows), rows=len(rows))
+
+    def overwrite(self, name, values):
+        def _write(ws):
+            ws.clear()
+            ws.update(values=values, range_name='A1')
+        self._call(name, "overwrite", _write, rows=len(values))
+
+    def update_cells(self, name, cells):
+        if not cells: return
+        data = [{"range": gspread.utils.rowcol_to_a1(r, c), "values": [[v]]} for r, c, v in cells]
+        self._call(name, "batch_update", lambda ws: ws.batch_update(data), rows=len({r for r, _, _ in cells}))
+
+    def delete_rows(self, name, row_numbers):
+        if not row_numbers: return
+        ws = self._worksheet(name)
+        # 連續的列號併成一段範圍 (封存整月時只有一兩段)；由下往上刪，前面的刪除才不會讓後面的列號位移，
+        # 全部併成一次 batchUpdate
+        runs = []
+        for r in sorted(set(row_numbers)):
+            if runs and runs[-1][1] == r - 1: runs[-1][1] = r
+            else: runs.append([r, r])
+        requests = [{"deleteDimension": {"range": {"sheetId": ws.id, "dimension": "ROWS", "startIndex": lo - 1, "endIndex": hi}}}
+                    for lo, hi in reversed(runs)]
+        doc = self._doc()
+        with self.metrics.timed("delete_rows", name) as call:
+            doc.batch_update({"requests": requests})
+            call["rows"] = sum(hi - lo + 1 for lo, hi in runs)
+
+
+# ==========================================
+# 後端二：本機 SQLite (可選擇同步鏡像回 Google 試算表)
+# ==========================================
+class SQLiteBackend(StorageBackend):
+    """每個工作表的每一列存成一筆 (sheet, row_no) 主鍵索引的 JSON 資料。
+
+    列號與試算表一致 (1 為標題列)，因此依列號的查詢與範圍讀取都走索引。
+    若指定 mirror，寫入本機成功後會再轉寫到鏡像後端，供仍習慣看試算表的同仁使用；
+    鏡像失敗不影響本機資料，但該表會標記為「待重送」(存在資料庫中，重啟後仍有效)，
+    下一次寫入改以本機內容整份覆蓋鏡像，避免依列號的更新/刪除套用到已錯位的列。
+    """
+
+    def __init__(self, path, mirror=None):
+        self.path = path
+        self.mirror = mirror
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS sheets (name TEXT PRIMARY KEY)")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS rows ("
+                " sheet TEXT NOT NULL, row_no INTEGER NOT NULL, data TEXT NOT NULL,"
+                " PRIMARY KEY (sheet, row_no)) WITHOUT ROWID"
+            )
+            self._conn.execute("CREATE TABLE IF NOT EXISTS mirror_dirty (sheet TEXT PRIMARY KEY)")
+
+    @staticmethod
+    def _encode(row):
+        return json.dumps(["" if v is None else str(v) for v in row], ensure_ascii=False)
+
+    def _require(self, name):
+        if not self._conn.execute("SELECT 1 FROM sheets WHERE name = ?", (name,)).fetchone():
+            raise SheetNotFound(name)
+
+    def _mirror(self, method, name, *args):
+        if self.mirror is None: return
+        with self._lock:
+            dirty = self._conn.execute("SELECT 1 FROM mirror_dirty WHERE sheet = ?", (name,)).fetchone() is not None
+        try:
+            if dirty:
+                # 鏡像先前寫入失敗，列號可能已對不上：以本機內容 (已含這次的變更) 整份覆蓋
+                self.mirror.ensure_sheet(name)
+                self.mirror.overwrite(name, self.get_values(name))
+                with self._lock, self._conn:
+                    self._conn.execute("DELETE FROM mirror_dirty WHERE sheet = ?", (name,))
+            else:
+                getattr(self.mirror, method)(name, *args)
+        except Exception:
+            logger.warning("鏡像寫入失敗：%s %s，下次寫入時整份重送", method, name, exc_info=True)
+            with self._lock, self._conn:
+                self._conn.execute("INSERT OR IGNORE INTO mirror_dirty VALUES (?)", (name,))
+
+    def list_sheets(self):
+        with self._lock:
+            return [r[0] for r in self._conn.execute("SELECT name FROM sheets ORDER BY rowid")]
+
+    def has_sheet(self, name):
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM sheets WHERE name = ?", (name,)).fetchone() is not None
+
+    def get_values(self, name):
+        with self._lock:
+            self._require(name)
+            rows = [json.loads(d) for (d,) in self._conn.execute(
+                "SELECT data FROM rows WHERE sheet = ? ORDER BY row_no", (name,))]
+        width = max((len(r) for r in rows), default=0)
+        return [r + [""] * (width - len(r)) for r in rows]
+
+    def get_tail(self, name, start_row):
+        with self._lock:
+            self._require(name)
+            found = {n: json.loads(d) for n, d in self._conn.execute(
+                "SELECT row_no, data FROM rows WHERE sheet = ? AND row_no IN (1, ?)", (name, start_row - 1))}
+            rows = [json.loads(d) for (d,) in self._conn.execute(
+                "SELECT data FROM rows WHERE sheet = ? AND row_no >= ? ORDER BY row_no", (name, start_row))]
+        return found.get(1, []), found.get(start_row - 1, []), rows
+
+    def create_sheet(self, name, headers=None, rows=2000):
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR IGNORE INTO sheets (name) VALUES (?)", (name,))
+            if headers:
+                self._conn.execute("INSERT OR REPLACE INTO rows VALUES (?, 1, ?)", (name, self._encode(headers)))
+        self._mirror("ensure_sheet", name, headers)
+
+    def append_rows(self, name, rows):
+        if not rows: return
+        with self._lock, self._conn:
+            self._require(name)
+            last = self._conn.execute("SELECT COALESCE(MAX(row_no), 0) FROM rows WHERE sheet = ?", (name,)).fetchone()[0]
+            self._conn.executemany("INSERT INTO rows VALUES (?, ?, ?)",
+                                   [(name, last + i + 1, self._encode(r)) for i, r in enumerate(rows)])
+        self._mirror("append_rows", name, rows)
+
+    def overwrite(self, name, values):
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR IGNORE INTO sheets (name) VALUES (?)", (name,))
+            self._conn.execute("DELETE FROM rows WHERE sheet = ?", (name,))
+            self._conn.executemany("INSERT INTO rows VALUES (?, ?, ?)",
+                                   [(name, i + 1, self._encode(r)) for i, r in enumerate(values)])
+        self._mirror("overwrite", name, values)
+
+    def update_cells(self, name, cells):
+        if not cells: return
+        by_row = {}
+        for r, c, v in cells: by_row.setdefault(r, []).append((c, v))
+        with self._lock, self._conn:
+            self._require(name)
+            for r, changes in by_row.items():
+                found = self._conn.execute("SELECT data FROM rows WHERE sheet = ? AND row_no = ?", (name, r)).fetchone()
+                row = json.loads(found[0]) if found else []
+                for c, v in changes:
+                    row += [""] * (c - len(row))
+                    row[c - 1] = v
+                self._conn.execute("INSERT OR REPLACE INTO rows VALUES (?, ?, ?)", (name, r, self._encode(row)))
+        self._mirror("update_cells", name, cells)
+
+    def delete_rows(self, name, row_numbers):
+        doomed = sorted(set(row_numbers))
+        if not doomed: return
+        with self._lock, self._conn:
+            self._require(name)
+            self._conn.executemany("DELETE FROM rows WHERE sheet = ? AND row_no = ?", [(name, r) for r in doomed])
+            below = [r for (r,) in self._conn.execute(
+                "SELECT row_no FROM rows WHERE sheet = ? AND row_no > ? ORDER BY row_no", (name, doomed[0]))]
+            # 先改成負號再翻回正號，避免遞補途中撞到主鍵
+            shifts, k = [], 0
+            for r in below:
+                while k < len(doomed) and doomed[k] < r: k += 1
+                shifts.append((-(r - k), name, r))
+            self._conn.executemany("UPDATE rows SET row_no = ? WHERE sheet = ? AND row_no = ?", shifts)
+            self._conn.execute("UPDATE rows SET row_no = -row_no WHERE sheet = ? AND row_no < 0", (name,))
+        self._mirror("delete_rows", name, doomed)
+
+    def import_from(self, source, names=None):
+        """從另一個後端 (通常是 Google 試算表) 整份複製工作表，用於初次切換到 SQLite。"""
+        for name in names or source.list_sheets():
+            try:
+                values = source.get_values(name)
+            except SheetNotFound:
+                continue
+            with self._lock, self._conn:
+                self._conn.execute("INSERT OR IGNORE INTO sheets (name) VALUES (?)", (name,))
+                self._conn.execute("DELETE FROM rows WHERE sheet = ?", (name,))
+                self._conn.executemany("INSERT INTO rows VALUES (?, ?, ?)",
+                                       [(name, i + 1, self._encode(r)) for i, r in enumerate(values)])
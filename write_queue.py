@@ -0,0 +1,183 @@
+import json
+import logging
+import random
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from storage import SheetNotFound
+
+logger = logging.getLogger(__name__)
+
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+def _status_code(e):
+    return getattr(getattr(e, "response", None), "status_code", None)
+
+
+def is_retryable(e):
+    """配額 (429) 與暫時性伺服器/網路錯誤才重試，其餘錯誤直接標記失敗。"""
+    return _status_code(e) in RETRY_STATUS or isinstance(e, (OSError, sqlite3.OperationalError))
+
+
+def is_ambiguous(e):
+    """伺服器可能已經套用了請求 (連線中斷、逾時、5xx)；429 與本機 SQLite 錯誤確定沒有寫入。"""
+    if isinstance(e, sqlite3.Error): return False
+    return (_status_code(e) or 0) >= 500 or isinstance(e, OSError)
+
+
+def _cell(v):
+    """比對用的儲存格文字：數字統一格式 (試算表會把 1.0 顯示成 1)。"""
+    s = "" if v is None else str(v).strip()
+    try:
+        return f"{float(s):g}"
+    except ValueError:
+        return s
+
+
+def _same_row(a, b):
+    a, b = [_cell(v) for v in a], [_cell(v) for v in b]
+    while a and a[-1] == "": a.pop()
+    while b and b[-1] == "": b.pop()
+    return a == b
+
+
+# ==========================================
+# 背景寫入佇列 (write-behind)
+#   送出的資料先落地到本機 spool 檔，再由單一背景執行緒寫入後端：
+#   同一張工作表的待寫批次會合併成一次 append_rows，遇到配額限制以指數退避重試，
+#   程式重啟後 spool 內尚未送出的批次會自動補送。
+#   附加列不是冪等操作：結果不明的失敗 (連線中斷、5xx) 重試前先比對工作表尾端，已寫入就不再重送；
+#   無法重試的失敗直接從 spool 移除 (內容記錄在錯誤日誌)，不會在重啟後被悄悄補送。
+# ==========================================
+class WriteQueue:
+    def __init__(self, backend, spool_path, on_commit=None, linger=0.5, max_backoff=64, row_hint=None):
+        self.backend = backend
+        self.on_commit = on_commit
+        self.row_hint = row_hint          # row_hint(工作表) → 已知的列數 (含標題列)；確認是否已寫入時只讀其後的尾端
+        self.linger = linger
+        self.max_backoff = max_backoff
+        self._cond = threading.Condition()
+        self._pending = []                # [(batch_id, sheet, rows, headers)]，依送出順序
+        self._status = OrderedDict()      # batch_id → {"state", "rows", "sheet", "error"}
+        self._spool = sqlite3.connect(spool_path, check_same_thread=False)
+        with self._cond, self._spool:
+            self._spool.execute(
+                "CREATE TABLE IF NOT EXISTS batches ("
+                " id TEXT PRIMARY KEY, sheet TEXT NOT NULL, rows TEXT NOT NULL, headers TEXT, created REAL NOT NULL)"
+            )
+            for batch_id, sheet, rows, headers in self._spool.execute(
+                    "SELECT id, sheet, rows, headers FROM batches ORDER BY created"):
+                rows, headers = json.loads(rows), json.loads(headers) if headers else None
+                self._pending.append((batch_id, sheet, rows, headers))
+                self._set_status(batch_id, "queued", sheet, len(rows))
+        self._worker = threading.Thread(target=self._run, name="write-queue", daemon=True)
+        self._worker.start()
+
+    def _set_status(self, batch_id, state, sheet=None, rows=None, error=None):
+        info = self._status.setdefault(batch_id, {"state": state, "sheet": sheet, "rows": rows, "error": None})
+        info["state"], info["error"] = state, error
+        self._status.move_to_end(batch_id)
+        while len(self._status) > 2000:
+            oldest, old_info = next(iter(self._status.items()))
+            if old_info["state"] == "queued": break
+            self._status.pop(oldest)
+
+    def submit(self, sheet, rows, headers=None):
+        """排入一批待附加的列，立即回傳批次編號 (不等待實際寫入)。"""
+        batch_id = uuid.uuid4().hex
+        rows = [["" if v is None else v for v in r] for r in rows]
+        with self._cond:
+            with self._spool:
+                self._spool.execute("INSERT INTO batches VALUES (?, ?, ?, ?, ?)",
+                                    (batch_id, sheet, json.dumps(rows, ensure_ascii=False),
+                                     json.dumps(headers, ensure_ascii=False) if headers else None, time.time()))
+            self._pending.append((batch_id, sheet, rows, headers))
+            self._set_status(batch_id, "queued", sheet, len(rows))
+            self._cond.notify()
+        return batch_id
+
+    def status(self, batch_id):
+        with self._cond:
+            return dict(self._status.get(batch_id, {"state": "unknown"}))
+
+    def _take_sheet(self):
+        """取出最早一批所屬工作表的全部待寫批次 (合併寫入)。"""
+        with self._cond:
+            while not self._pending:
+                self._cond.wait()
+        time.sleep(self.linger)  # 稍等片刻，讓同時間送出的批次一起合併
+        with self._cond:
+            sheet = self._pending[0][1]
+            return sheet, [b for b in self._pending if b[1] == sheet]
+
+    def _landed(self, sheet, rows):
+        """上一次附加的結果不明時，確認工作表最後幾列是否就是這批資料。
+
+        只讀已知列數 (減去這批的列數，以防快取已同步到這批) 之後的尾端，不在 API 不穩時整份下載；
+        不知道列數或列已被刪減 (get_tail 回傳 None) 時才整份讀取。
+        """
+        known = self.row_hint(sheet) if self.row_hint else 0
+        try:
+            tail = self.backend.get_tail(sheet, max(known - len(rows) + 1, 2)) if known > 1 else None
+            values = tail[2] if tail is not None else self.backend.get_values(sheet)[1:]
+        except SheetNotFound:
+            return False
+        if len(values) < len(rows): return False
+        return all(_same_row(a, b) for a, b in zip(values[-len(rows):], rows))
+
+    def _finish(self, batch_ids, state, error=None):
+        with self._cond:
+            with self._spool:
+                self._spool.executemany("DELETE FROM batches WHERE id = ?", [(i,) for i in batch_ids])
+            self._pending = [b for b in self._pending if b[0] not in batch_ids]
+            for i in batch_ids: self._set_status(i, state, error=error)
+
+    def _committed(self, sheet, batch_ids):
+        self._finish(batch_ids, "committed")
+        if self.on_commit:
+            try:
+                self.on_commit(sheet)
+            except Exception:
+                logger.warning("on_commit 回呼失敗", exc_info=True)
+
+    def _run(self):
+        attempt = 0
+        unsure = set()   # 上次附加結果不明的批次 (重試前要先確認是否其實已寫入)
+        while True:
+            sheet, batches = self._take_sheet()
+            rows = [r for b in batches for r in b[2]]
+            headers = next((b[3] for b in batches if b[3]), None)
+            checking = bool(unsure)
+            try:
+                if checking:
+                    sent = [b for b in batches if b[0] in unsure]
+                    if self._landed(sheet, [r for b in sent for r in b[2]]):
+                        logger.info("寫入 %s 的回應遺失，但資料已在工作表上，不再重送", sheet)
+                        unsure, attempt = set(), 0
+                        self._committed(sheet, {b[0] for b in sent})
+                        continue
+                    unsure, checking = set(), False
+                self.backend.ensure_sheet(sheet, headers)
+                self.backend.append_rows(sheet, rows)
+            except Exception as e:
+                if not checking: unsure = {b[0] for b in batches} if is_ambiguous(e) else set()
+                if is_retryable(e):
+                    delay = min(2 ** attempt, self.max_backoff) + random.uniform(0, 1)
+                    attempt += 1
+                    logger.warning("寫入 %s 失敗 (%s)，%.1f 秒後重試", sheet, e, delay)
+                    with self._cond:
+                        for b in batches: self._set_status(b[0], "queued", error=f"重試中：{e}")
+                    time.sleep(delay)
+                else:
+                    # 使用者已看到「寫入失敗」並會重新登記，從 spool 移除以免重啟後重複補送
+                    logger.error("寫入 %s 失敗，已放棄這 %d 列：%s", sheet, len(rows),
+                                 json.dumps(rows, ensure_ascii=False), exc_info=True)
+                    unsure = set()
+                    self._finish({b[0] for b in batches}, "failed", error=str(e))
+                continue
+            attempt = 0
+            self._committed(sheet, {b[0] for b in batches})